@@ -1,5 +1,5 @@
 from flask import Flask
-from celery import Celery, Task
+from celery import Celery, Task, states
 
 
 def celery_init_app(app: Flask) -> Celery:
@@ -8,6 +8,28 @@ def celery_init_app(app: Flask) -> Celery:
             with app.app_context():
                 return self.run(*args, **kwargs)
 
+        def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+            super().update_state(task_id=task_id, state=state, meta=meta, **kwargs)
+            # Push the progress to the clients streaming the task's events
+            self._publish_event(task_id or self.request.id, state, meta)
+
+        def after_return(self, status, retval, task_id, args, kwargs, einfo):
+            super().after_return(status, retval, task_id, args, kwargs, einfo)
+            # The result is stored by now, subscribers read it from the result backend
+            if status in states.READY_STATES:
+                self._publish_event(task_id, status)
+
+        def _publish_event(self, task_id, state, meta=None):
+            # Imported here, the Redis client needs the app to be initialized
+            from util.redis_client import get_redis
+            from util.task_events import publish_task_event
+
+            try:
+                publish_task_event(get_redis(), task_id, state, meta)
+            except Exception as e:
+                # Clients still get the result from the result backend
+                print("Unable to publish task event: ", str(e))
+
     celery_app = Celery(app.name, task_cls=FlaskTask, include=["tasks"])
     celery_app.config_from_object(app.config["CELERY"])
     celery_app.set_default()
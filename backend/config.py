@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import tempfile
+from kombu import Queue
 
 
 class Config(object):
@@ -11,10 +13,138 @@ class Config(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False  # Set to True to see SQL queries output in the console
     UPLOAD_DIR = os.environ.get("UPLOAD_DIR") or "/uploads"
+    # Where uploads are kept until their quiz is generated, "local" stores them in UPLOAD_DIR
+    UPLOAD_STORAGE = os.environ.get("UPLOAD_STORAGE") or "local"
+    UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE") or 1024 * 1024)
+    # Number of processes parsing the files of a quiz at the same time
+    QUIZGPT_PARSE_WORKERS = int(os.environ.get("QUIZGPT_PARSE_WORKERS") or 4)
+    # Parsed pages of uploaded files, reused when the same file is uploaded again
+    PARSE_CACHE_ENABLED = os.environ.get("PARSE_CACHE_ENABLED", "true") == "true"
+    PARSE_CACHE_DIR = os.environ.get("PARSE_CACHE_DIR") or os.path.join(
+        tempfile.gettempdir(), "quiz-buddy-parse-cache"
+    )
+    PARSE_CACHE_MAX_BYTES = int(
+        os.environ.get("PARSE_CACHE_MAX_BYTES") or 512 * 1024 * 1024
+    )  # 512 MB
     ALLOWED_EXTENSIONS = {"pdf", "txt", "md", "docx", "doc"}
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50 MB limit
+    # Maximum number of quizzes of a single page of GET /quizzes
+    QUIZZES_PAGE_MAX_LIMIT = int(os.environ.get("QUIZZES_PAGE_MAX_LIMIT") or 50)
+    # Maximum number of concurrent question generation requests per OpenAI API key, in each worker
+    # process (the requests per minute across workers are bounded by the OpenAI rate limiter)
+    QUIZGPT_MAX_CONCURRENCY = int(os.environ.get("QUIZGPT_MAX_CONCURRENCY") or 4)
+    # Number of segments sent to GPT in a single request, 1 generates each question separately
+    QUIZGPT_BATCH_SIZE = int(os.environ.get("QUIZGPT_BATCH_SIZE") or 1)
+    # Maximum number of tokens of the content a single question is generated from
+    QUIZGPT_SEGMENT_MAX_TOKENS = int(
+        os.environ.get("QUIZGPT_SEGMENT_MAX_TOKENS") or 1500
+    )
+    # Minimum confidence of the offline language detection, below it GPT is asked instead
+    QUIZGPT_LANGUAGE_DETECTION_THRESHOLD = float(
+        os.environ.get("QUIZGPT_LANGUAGE_DETECTION_THRESHOLD") or 0.9
+    )
+    REDIS_URL = (
+        os.environ.get("REDIS_URL")
+        or os.environ.get("CELERY_BROKER_URL")
+        or "redis://localhost"
+    )
+    # Generated questions, reused when the same content is processed again
+    RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true") == "true"
+    RESPONSE_CACHE_TTL = int(
+        os.environ.get("RESPONSE_CACHE_TTL") or 30 * 24 * 60 * 60
+    )  # 30 days
+    RESPONSE_CACHE_MAX_ENTRIES = int(
+        os.environ.get("RESPONSE_CACHE_MAX_ENTRIES") or 100_000
+    )
+    # How long the questions generated by an interrupted task are kept for it to resume
+    QUIZ_CHECKPOINT_TTL = int(os.environ.get("QUIZ_CHECKPOINT_TTL") or 24 * 60 * 60)
+    # Times a quiz's task is delivered again, after its worker was lost or it outlived the broker's
+    # visibility timeout, before it fails for good. Retries after transient errors do not count.
+    QUIZ_MAX_REDELIVERIES = int(os.environ.get("QUIZ_MAX_REDELIVERIES") or 2)
+    # "local" generates all the questions of a quiz in its task, "canvas" fans them out to a task
+    # per question, so a single quiz can use every worker
+    QUIZ_GENERATION_MODE = os.environ.get("QUIZ_GENERATION_MODE") or "local"
+    # Requests and tokens per minute allowed for each OpenAI API key and model, shared by every
+    # worker, 0 disables the limit
+    OPENAI_RATE_LIMIT_ENABLED = (
+        os.environ.get("OPENAI_RATE_LIMIT_ENABLED", "true") == "true"
+    )
+    OPENAI_REQUESTS_PER_MINUTE = int(
+        os.environ.get("OPENAI_REQUESTS_PER_MINUTE") or 500
+    )
+    OPENAI_TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_TOKENS_PER_MINUTE") or 30_000)
+    # Retries of rate limited and failed OpenAI requests, with exponential backoff (in seconds)
+    OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES") or 6)
+    OPENAI_BACKOFF_BASE = float(os.environ.get("OPENAI_BACKOFF_BASE") or 1.0)
+    OPENAI_BACKOFF_MAX = float(os.environ.get("OPENAI_BACKOFF_MAX") or 60.0)
+    # Consecutive failures after which every worker holds its requests for the cooldown (in seconds)
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD = int(
+        os.environ.get("OPENAI_CIRCUIT_FAILURE_THRESHOLD") or 5
+    )
+    OPENAI_CIRCUIT_COOLDOWN = float(os.environ.get("OPENAI_CIRCUIT_COOLDOWN") or 30.0)
+    # "openai", or "stub" to generate placeholder questions offline, e.g. for load tests
+    LLM_PROVIDER = os.environ.get("LLM_PROVIDER") or "openai"
+    # Seconds the stub takes to answer (plus a random jitter), and the shares of its questions that
+    # are unsuccessful, or too short
+    STUB_LLM_LATENCY = float(os.environ.get("STUB_LLM_LATENCY") or 1.0)
+    STUB_LLM_LATENCY_JITTER = float(os.environ.get("STUB_LLM_LATENCY_JITTER") or 0.5)
+    STUB_LLM_FAILURE_RATE = float(os.environ.get("STUB_LLM_FAILURE_RATE") or 0.0)
+    STUB_LLM_TOO_SHORT_RATE = float(os.environ.get("STUB_LLM_TOO_SHORT_RATE") or 0.0)
+    STUB_LLM_SEED = int(os.environ.get("STUB_LLM_SEED") or 0)
+    # Seconds a task's event stream stays open (clients reconnect after it), and between keepalives
+    TASK_STREAM_TIMEOUT = int(os.environ.get("TASK_STREAM_TIMEOUT") or 5 * 60)
+    TASK_STREAM_KEEPALIVE = int(os.environ.get("TASK_STREAM_KEEPALIVE") or 15)
+    # Event streams a server process keeps open at once, each one holds a worker thread. 0 disables
+    # them, which suits the default sync workers: `/result/<id>` then tells clients to poll, see
+    # the README
+    TASK_STREAM_MAX_CONNECTIONS = int(
+        os.environ.get("TASK_STREAM_MAX_CONNECTIONS") or 0
+    )
+    # Maximum number of task IDs of a single batch status request
+    TASK_RESULTS_MAX_IDS = int(os.environ.get("TASK_RESULTS_MAX_IDS") or 100)
+    # Identical quiz requests share the task already generating their quiz, its lock expires after
+    # this many seconds in case the task never releases it
+    SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true") == "true"
+    SINGLE_FLIGHT_TTL = int(os.environ.get("SINGLE_FLIGHT_TTL") or 60 * 60)
+    # Quizzes with more questions, or larger uploads, go to the "quizzes.large" queue
+    LARGE_QUIZ_MIN_QUESTIONS = int(os.environ.get("LARGE_QUIZ_MIN_QUESTIONS") or 20)
+    LARGE_QUIZ_MIN_UPLOAD_BYTES = int(
+        os.environ.get("LARGE_QUIZ_MIN_UPLOAD_BYTES") or 5 * 1024 * 1024
+    )  # 5 MB
+    # Each queued or running quiz of a client lowers the priority of their next one, until they
+    # are done or after this many seconds
+    FAIR_SCHEDULING_TTL = int(os.environ.get("FAIR_SCHEDULING_TTL") or 3 * 60 * 60)
+    # Serialized quizzes of GET /quizzes/<id> are cached in Redis, and for a few seconds in each
+    # process in front of it
+    QUIZ_CACHE_ENABLED = os.environ.get("QUIZ_CACHE_ENABLED", "true") == "true"
+    QUIZ_CACHE_TTL = int(os.environ.get("QUIZ_CACHE_TTL") or 24 * 60 * 60)
+    QUIZ_CACHE_LOCAL_TTL = float(os.environ.get("QUIZ_CACHE_LOCAL_TTL") or 5)
+    QUIZ_CACHE_LOCAL_MAX_ENTRIES = int(
+        os.environ.get("QUIZ_CACHE_LOCAL_MAX_ENTRIES") or 1024
+    )
+    # Seconds browsers and CDNs can reuse the subject and quiz listings, and the original quizzes
+    # (which never change) without revalidating them
+    LISTING_MAX_AGE = int(os.environ.get("LISTING_MAX_AGE") or 30)
+    ORIGINAL_QUIZ_MAX_AGE = int(os.environ.get("ORIGINAL_QUIZ_MAX_AGE") or 24 * 60 * 60)
     CELERY = dict(
         broker_url=os.environ.get("CELERY_BROKER_URL") or "redis://localhost",
         result_backend=os.environ.get("CELERY_RESULT_BACKEND") or "redis://localhost",
         task_ignore_result=True,
+        broker_transport_options={
+            # Unacknowledged (late ack) tasks are delivered again after this many seconds, it must
+            # be longer than the longest quiz generation
+            "visibility_timeout": 3 * 60 * 60,
+            # A list per priority (0 is consumed first), see `util.scheduling`
+            "priority_steps": list(range(10)),
+            "sep": ":",
+            "queue_order_strategy": "priority",
+        },
+        task_queues=[
+            Queue("quizzes.small"),
+            Queue("quizzes.large"),
+            Queue("celery"),
+        ],
+        task_routes=("util.scheduling.route_task",),
+        # Reserve one task at a time, so that priorities apply to the tasks that are still queued
+        worker_prefetch_multiplier=1,
     )
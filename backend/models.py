@@ -1,19 +1,25 @@
 from app import db
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from util.index import BaseModel
+from util.search import quiz_search_vector_sql
 
 
 class Answer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     is_correct = db.Column(db.Boolean, default=False)
-    question_id = db.Column(db.Integer, db.ForeignKey("question.id"), nullable=False)
+    question_id = db.Column(
+        db.Integer, db.ForeignKey("question.id"), nullable=False, index=True
+    )
 
 
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
-    quiz_id = db.Column(db.Integer, db.ForeignKey("quiz.id"), nullable=False)
+    quiz_id = db.Column(
+        db.Integer, db.ForeignKey("quiz.id"), nullable=False, index=True
+    )
     answers = relationship("Answer", backref="question", cascade="all, delete-orphan")
 
 
@@ -21,6 +27,16 @@ class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
 
+    __table_args__ = (
+        # Trigram index, for the ILIKE searches of the subjects
+        db.Index(
+            "ix_subject_title_trgm",
+            "title",
+            postgresql_using="gin",
+            postgresql_ops={"title": "gin_trgm_ops"},
+        ),
+    )
+
 
 class Quiz(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -29,21 +45,56 @@ class Quiz(db.Model):
     success_percentage = db.Column(db.Integer, nullable=False)
     description = db.Column(db.String(1024))
     duration = db.Column(db.Integer, nullable=False)
-    subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=False)
+    subject_id = db.Column(
+        db.Integer, db.ForeignKey("subject.id"), nullable=False, index=True
+    )
     subject = relationship("Subject", backref="quizzes")
     questions = relationship("Question", backref="quiz", cascade="all, delete-orphan")
     user_ip = db.Column(db.String(255), nullable=False)
     is_shared = db.Column(db.Boolean, default=False)
     language = db.Column(db.String(7), nullable=False)
     is_quiz_buddy_original = db.Column(db.Boolean, default=False)
+    # ID of the task that generated the quiz, so that a redelivered task does not create it twice
+    task_id = db.Column(db.String(155), unique=True)
+    # Kept in sync with `questions` when the quiz is created, so listings do not have to load them
+    question_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    # Full text search document of the title and description, stemmed in the quiz's language
+    search_vector = db.Column(
+        TSVECTOR, db.Computed(quiz_search_vector_sql(), persisted=True), nullable=True
+    )
+
+    __table_args__ = (
+        db.Index("ix_quiz_search_vector", "search_vector", postgresql_using="gin"),
+        # Pages of the shared quizzes, newest first, optionally of a subject and/or language
+        db.Index("ix_quiz_shared_id", "id", postgresql_where=db.text("is_shared")),
+        db.Index(
+            "ix_quiz_shared_subject_id_language_id",
+            "subject_id",
+            "language",
+            "id",
+            postgresql_where=db.text("is_shared"),
+        ),
+        db.Index(
+            "ix_quiz_shared_language_id",
+            "language",
+            "id",
+            postgresql_where=db.text("is_shared"),
+        ),
+    )
 
 
 class UserChoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    question_id = db.Column(db.Integer, db.ForeignKey("question.id"), nullable=False)
-    choice_id = db.Column(db.Integer, db.ForeignKey("answer.id"), nullable=True)
+    question_id = db.Column(
+        db.Integer, db.ForeignKey("question.id"), nullable=False, index=True
+    )
+    choice_id = db.Column(
+        db.Integer, db.ForeignKey("answer.id"), nullable=True, index=True
+    )
     quiz_attempt_id = db.Column(
-        db.Integer, db.ForeignKey("quiz_attempt.id"), nullable=False
+        db.Integer, db.ForeignKey("quiz_attempt.id"), nullable=False, index=True
     )
     question = relationship("Question", backref="user_choices")
     choice = relationship("Answer", backref="user_choices")
@@ -51,7 +102,9 @@ class UserChoice(db.Model):
 
 class QuizAttempt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey("quiz.id"), nullable=False)
+    quiz_id = db.Column(
+        db.Integer, db.ForeignKey("quiz.id"), nullable=False, index=True
+    )
     quiz = relationship("Quiz", backref="attempts")
     result = db.Column(db.Integer, nullable=False)
     did_pass = db.Column(db.Boolean, nullable=False)
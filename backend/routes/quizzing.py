@@ -1,13 +1,21 @@
-import os
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, abort, jsonify, request
 from app import db, app
-from werkzeug.utils import secure_filename
+from util.http_cache import conditional_json, make_etag
 from util.index import allowed_file, get_file_extension, remove_files
+from util.quiz_cache import get_quiz_cache
+from util.redis_client import get_redis
+from util.scheduling import FairScheduler
+from util.search import escape_like, quiz_search_query
+from util.single_flight import SingleFlight
+from util.storage import get_upload_storage
 from models import Quiz, Question, Answer, Subject, QuizAttempt, UserChoice
 from uuid import uuid4
 import tasks
-from sqlalchemy import desc, and_, or_
+from sqlalchemy import desc, and_, or_, func, cast
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from sqlalchemy.orm import joinedload, selectinload
 from base64 import b64encode, b64decode
+import hashlib
 import json
 
 quizzing_blueprint = Blueprint("quizzing", __name__, url_prefix="/api")
@@ -19,18 +27,28 @@ def get_subjects():
     search_query = request.args.get("search_query")
     subjects = Subject.query
     if search_query:
-        # escape any single or doble quotes in the search query
-        search_query = search_query.replace("'", "").replace('"', "")
-        subjects = subjects.filter(Subject.title.ilike(f"%{search_query}%"))
-    subjects_data = [{"id": s.id, "title": s.title} for s in subjects.all()]
-    return jsonify(subjects_data)
+        # Served by the trigram index of the titles, the closest ones first
+        subjects = subjects.filter(
+            Subject.title.ilike(f"%{escape_like(search_query)}%", escape="\\")
+        ).order_by(desc(func.similarity(Subject.title, search_query)))
+    subjects = subjects.all()
+
+    return conditional_json(
+        make_etag(*(f"{s.id}:{s.title}" for s in subjects)),
+        f"public, max-age={app.config['LISTING_MAX_AGE']}",
+        lambda: [{"id": s.id, "title": s.title} for s in subjects],
+    )
 
 
 @quizzing_blueprint.route("/subjects/<int:subject_id>", methods=["GET"])
 def get_subject(subject_id):
     subject = Subject.query.get_or_404(subject_id)
 
-    return jsonify({"id": subject.id, "title": subject.title})
+    return conditional_json(
+        make_etag(subject.id, subject.title),
+        f"public, max-age={app.config['LISTING_MAX_AGE']}",
+        lambda: {"id": subject.id, "title": subject.title},
+    )
 
 
 # Create Subject
@@ -104,6 +122,8 @@ def create_quiz():
     duration = data.get("duration")
     number_of_questions = data.get("number_of_questions")
     number_of_questions = int(number_of_questions) if number_of_questions else 0
+    # Clients can opt out of reusing questions generated earlier for the same content
+    use_cache = data.get("use_cache", "true").lower() != "false"
 
     try:
         # Make sure the subject exists
@@ -134,32 +154,77 @@ def create_quiz():
                 400,
             )
 
-    # Save files
+    # Save files, identical files share the same stored data
+    storage = get_upload_storage()
+    files_hashes = []
     for file in files:
         if file:
-            filename = secure_filename(file.filename)
-            filename = str(uuid4()) + "." + get_file_extension(file.filename)
-
-            file_path = os.path.join(app.config["UPLOAD_DIR"], filename)
-
-            file.save(file_path)
-            created_files_paths.append(file_path)
+            stored_upload = storage.save(file.stream, get_file_extension(file.filename))
+            created_files_paths.append(stored_upload.reference)
+            files_hashes.append(stored_upload.sha256)
 
     # Associate each quiz with the user's IP address to block users/quizzes that may be harmful or inappropriate
     user_ip = request.headers.get("X-Forwarded-For", request.remote_addr)
 
-    task = tasks.create_quiz.delay(
-        openai_api_key,
-        subject_id,
-        title,
-        success_percentage,
-        description,
-        duration,
-        number_of_questions,
-        created_files_paths,
-        user_ip,
+    # Identical requests (same requester, files and options) attach to the task already generating
+    # their quiz, instead of generating it again. The task runs with the first request's API key
+    # and options, so they are all part of the key.
+    task_id = str(uuid4())
+    single_flight = None
+    single_flight_key = None
+    if app.config["SINGLE_FLIGHT_ENABLED"]:
+        single_flight = SingleFlight(get_redis(), ttl=app.config["SINGLE_FLIGHT_TTL"])
+        single_flight_key = SingleFlight.key(
+            *files_hashes,
+            hashlib.sha256((openai_api_key or "").encode()).hexdigest(),
+            user_ip,
+            str(subject_id),
+            str(title),
+            str(success_percentage),
+            str(description),
+            str(duration),
+            str(number_of_questions),
+            str(use_cache),
+        )
+        in_flight_task_id = single_flight.acquire(single_flight_key, task_id)
+        if in_flight_task_id:
+            remove_files(created_files_paths)
+            return jsonify({"task_id": in_flight_task_id}), 202
+
+    # The more quizzes the client already has queued or running, the lower the priority of this one
+    priority = FairScheduler(get_redis(), ttl=app.config["FAIR_SCHEDULING_TTL"]).enter(
+        user_ip
     )
 
+    # The task's queue is chosen by `util.scheduling.route_task`
+    try:
+        task = tasks.create_quiz.apply_async(
+            args=[
+                openai_api_key,
+                subject_id,
+                title,
+                success_percentage,
+                description,
+                duration,
+                number_of_questions,
+                created_files_paths,
+            ],
+            kwargs={
+                "user_ip": user_ip,
+                "use_response_cache": use_cache,
+                "single_flight_key": single_flight_key,
+            },
+            task_id=task_id,
+            priority=priority,
+        )
+    except Exception:
+        # The task will never release them
+        if single_flight:
+            single_flight.release(single_flight_key, task_id)
+        FairScheduler(get_redis(), ttl=app.config["FAIR_SCHEDULING_TTL"]).leave(user_ip)
+        remove_files(created_files_paths)
+        raise
+
     return jsonify({"task_id": task.id}), 202
 
 
@@ -174,17 +239,10 @@ def get_quizzes():
     language = request.args.get("language")
     cursor = request.args.get("cursor")
     limit = request.args.get("limit", 12, type=int)
+    limit = min(max(limit, 1), app.config["QUIZZES_PAGE_MAX_LIMIT"])
 
-    quizzes = Quiz.query.filter_by(is_shared=True)
-
-    if search_query:
-        search_query = search_query.replace("'", "").replace('"', "")
-        quizzes = quizzes.filter(
-            or_(
-                Quiz.title.ilike(f"%{search_query}%"),
-                Quiz.description.ilike(f"%{search_query}%"),
-            )
-        )
+    # The subject is joined in the same query, and the number of questions is stored on the quiz
+    quizzes = Quiz.query.options(joinedload(Quiz.subject)).filter_by(is_shared=True)
 
     if subject_id:
         quizzes = quizzes.filter_by(subject_id=subject_id)
@@ -192,56 +250,128 @@ def get_quizzes():
     if language:
         quizzes = quizzes.filter_by(language=language)
 
-    # Order by id descending (assuming newest first)
-    quizzes = quizzes.order_by(desc(Quiz.id))
+    cursor_data = json.loads(b64decode(cursor)) if cursor else {}
+    last_id = cursor_data.get("last_id")
 
-    # Apply cursor if provided
-    if cursor:
-        cursor_data = json.loads(b64decode(cursor))
-        last_id = cursor_data.get("last_id")
+    if search_query:
+        # Full text search with the GIN index of the quizzes, the most relevant ones first
+        tsquery = quiz_search_query(search_query, language)
+        # ts_rank is a real, cast to the double the cursor stores, so that ties compare equal
+        rank = cast(func.ts_rank(Quiz.search_vector, tsquery), DOUBLE_PRECISION)
+        quizzes = quizzes.filter(Quiz.search_vector.bool_op("@@")(tsquery))
+        quizzes = quizzes.add_columns(rank.label("rank"))
+        quizzes = quizzes.order_by(desc(rank), desc(Quiz.id))
+
+        last_rank = cursor_data.get("last_rank")
+        if last_id and last_rank is not None:
+            quizzes = quizzes.filter(
+                or_(rank < last_rank, and_(rank == last_rank, Quiz.id < last_id))
+            )
+    else:
+        # Order by id descending (assuming newest first)
+        quizzes = quizzes.order_by(desc(Quiz.id))
         if last_id:
             quizzes = quizzes.filter(Quiz.id < last_id)
 
     # Fetch one extra to determine if there are more results
-    quizzes = quizzes.limit(limit + 1).all()
-
-    has_more = len(quizzes) > limit
-    quizzes = quizzes[:limit]  # Trim to requested limit
+    rows = quizzes.limit(limit + 1).all()
 
-    quizzes_data = [
-        {
-            "id": q.id,
-            "subject_id": q.subject_id,
-            "subject_title": q.subject.title,
-            "title": q.title,
-            "success_percentage": q.success_percentage,
-            "description": q.description,
-            "duration": q.duration,
-            "number_of_questions": len(q.questions),
-        }
-        for q in quizzes
-    ]
+    has_more = len(rows) > limit
+    rows = rows[:limit]  # Trim to requested limit
+    quizzes = [row[0] for row in rows] if search_query else rows
 
     # Create the next cursor
     next_cursor = None
     if has_more and quizzes:
         last_quiz = quizzes[-1]
         cursor_data = {"last_id": last_quiz.id}
+        if search_query:
+            cursor_data["last_rank"] = rows[-1].rank
         next_cursor = b64encode(json.dumps(cursor_data).encode()).decode()
 
-    response = {
-        "quizzes": quizzes_data,
-        "has_more": has_more,
-        "next_cursor": next_cursor,
+    def build_response():
+        quizzes_data = [
+            {
+                "id": q.id,
+                "subject_id": q.subject_id,
+                "subject_title": q.subject.title,
+                "title": q.title,
+                "success_percentage": q.success_percentage,
+                "description": q.description,
+                "duration": q.duration,
+                "number_of_questions": q.question_count,
+            }
+            for q in quizzes
+        ]
+
+        return {
+            "quizzes": quizzes_data,
+            "has_more": has_more,
+            "next_cursor": next_cursor,
+        }
+
+    # Quizzes do not change once created, only their subject's title can
+    etag = make_etag(
+        has_more, next_cursor, *(f"{q.id}:{q.subject.title}" for q in quizzes)
+    )
+    return conditional_json(
+        etag, f"public, max-age={app.config['LISTING_MAX_AGE']}", build_response
+    )
+
+
+def load_quiz(quiz_id: int):
+    """
+    Returns the serialized quiz, with what is needed to tell who can delete it, or None if it
+    does not exist. The questions and their answers are loaded with a query each.
+    """
+    quiz = db.session.get(
+        Quiz,
+        quiz_id,
+        options=[selectinload(Quiz.questions).selectinload(Question.answers)],
+    )
+    if quiz is None:
+        return None
+
+    data = {
+        "id": quiz.id,
+        "subject_id": quiz.subject_id,
+        "title": quiz.title,
+        "success_percentage": quiz.success_percentage,
+        "description": quiz.description,
+        "duration": quiz.duration,
+        "questions": [
+            {
+                "id": q.id,
+                "title": q.title,
+                "answers": [
+                    {"id": a.id, "title": a.title, "is_correct": a.is_correct}
+                    for a in q.answers
+                ],
+            }
+            for q in quiz.questions
+        ],
+        "language": quiz.language,
     }
 
-    return jsonify(response)
+    return {
+        "quiz": data,
+        # Hash of the content, for the ETag of the response
+        "version": make_etag(json.dumps(data, sort_keys=True)),
+        "user_ip": quiz.user_ip,
+        "is_quiz_buddy_original": bool(quiz.is_quiz_buddy_original),
+    }
 
 
 # Get Quiz
 @quizzing_blueprint.route("/quizzes/<int:quiz_id>", methods=["GET"])
 def get_quiz(quiz_id):
-    quiz = Quiz.query.get_or_404(quiz_id)
+    if app.config["QUIZ_CACHE_ENABLED"]:
+        entry = get_quiz_cache().get(quiz_id, lambda: load_quiz(quiz_id))
+    else:
+        entry = load_quiz(quiz_id)
+
+    if entry is None:
+        abort(404)
 
     user_ip = request.headers.get("X-Forwarded-For", request.remote_addr)
 
@@ -253,28 +383,22 @@ def get_quiz(quiz_id):
     #             403,
     #         )
 
-    return jsonify(
-        {
-            "id": quiz.id,
-            "subject_id": quiz.subject_id,
-            "title": quiz.title,
-            "success_percentage": quiz.success_percentage,
-            "description": quiz.description,
-            "duration": quiz.duration,
-            "questions": [
-                {
-                    "id": q.id,
-                    "title": q.title,
-                    "answers": [
-                        {"id": a.id, "title": a.title, "is_correct": a.is_correct}
-                        for a in q.answers
-                    ],
-                }
-                for q in quiz.questions
-            ],
-            "language": quiz.language,
-            "can_delete": quiz.user_ip == user_ip and not quiz.is_quiz_buddy_original,
-        }
+    # Depends on the requester, so it is not part of the cached quiz
+    can_delete = entry["user_ip"] == user_ip and not entry["is_quiz_buddy_original"]
+
+    if entry["is_quiz_buddy_original"]:
+        # The same for everyone, and never changes
+        cache_control = (
+            f"public, max-age={app.config['ORIGINAL_QUIZ_MAX_AGE']}, immutable"
+        )
+    else:
+        # Can be deleted, and `can_delete` depends on the requester
+        cache_control = "private, no-cache"
+
+    return conditional_json(
+        make_etag(entry["version"], can_delete),
+        cache_control,
+        lambda: {**entry["quiz"], "can_delete": can_delete},
     )
 
 
@@ -305,6 +429,9 @@ def delete_quiz(quiz_id):
         db.session.delete(quiz)
         db.session.commit()
 
+        if app.config["QUIZ_CACHE_ENABLED"]:
+            get_quiz_cache().invalidate(quiz_id)
+
         return jsonify({"message": "Quiz deleted successfully!"}), 200
 
     except Exception as e:
@@ -444,4 +571,7 @@ def share_quiz(quiz_id):
     quiz.is_shared = True
     db.session.commit()
 
+    if app.config["QUIZ_CACHE_ENABLED"]:
+        get_quiz_cache().invalidate(quiz_id)
+
     return jsonify({"message": "Quiz shared status updated successfully!"}), 200
@@ -1,35 +1,177 @@
-from flask import Blueprint
+import json
+import time
+import threading
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from celery import states
 from celery.result import AsyncResult
+from tasks import get_fair_scheduler, get_response_cache
+from util.redis_client import get_redis
+from util.task_events import serialize_task_meta, task_events_channel
 
 tasks_blueprint = Blueprint("tasks", __name__, url_prefix="/api")
 
 
+def get_task_response(id: str) -> dict[str, object]:
+    # A single read of the result backend, the AsyncResult properties each read it again
+    result = AsyncResult(id)
+    return serialize_task_meta(result.backend.get_task_meta(id))
+
+
 @tasks_blueprint.get("/result/<id>")
 def task_result(id: str) -> dict[str, object]:
-    result = AsyncResult(id)
-    response = {
-        "ready": result.ready(),
-        "successful": result.successful(),
-        "value": result.result if result.ready() else None,
+    response = get_task_response(id)
+    # Whether the client may follow the task with `/stream/<id>` instead of polling
+    response["stream"] = current_app.config["TASK_STREAM_MAX_CONNECTIONS"] > 0
+    return response
+
+
+def get_task_responses(ids: list[str]) -> dict[str, dict[str, object]]:
+    """
+    Returns the responses of many tasks, read from the result backend in a single MGET when it is a
+    key/value store (e.g. Redis).
+    """
+    if not ids:
+        return {}
+
+    backend = current_app.extensions["celery"].backend
+    if not hasattr(backend, "mget"):
+        return {id: serialize_task_meta(backend.get_task_meta(id)) for id in ids}
+
+    values = backend.mget([backend.get_key_for_task(id) for id in ids])
+    return {
+        id: serialize_task_meta(
+            backend.decode_result(value)
+            if value
+            else {"status": states.PENDING, "result": None}
+        )
+        for id, value in zip(ids, values)
     }
 
-    # Incorrect OpenAI API key provided
-    if (
-        response["ready"]
-        and "Incorrect API key provided"
-        in response["value"]["details"]["response_message"]
-    ):
-        response["successful"] = False
-        response["value"] = {
-            "message": "Error during quiz creation",
-            "quiz_id": None,
-            "details": {
-                "response_message": "Incorrect API key provided",
-                "response_code": 401,
-            },
-        }
-
-    if result.state == "PROGRESS":
-        response["progress"] = result.info
 
+@tasks_blueprint.post("/results")
+def task_results():
+    """
+    Returns the responses of `/result/<id>` for every task ID of the `ids` list, keyed by ID.
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(id, str) for id in ids):
+        return jsonify({"error": "ids must be a list of task ids"}), 400
+
+    max_ids = current_app.config["TASK_RESULTS_MAX_IDS"]
+    if len(ids) > max_ids:
+        return (
+            jsonify({"error": f"At most {max_ids} task ids can be requested at once"}),
+            400,
+        )
+
+    # Duplicates are read once
+    ids = list(dict.fromkeys(ids))
+    return jsonify({"results": get_task_responses(ids)})
+
+
+# Number of event streams open in this process, see `TASK_STREAM_MAX_CONNECTIONS`
+open_streams = 0
+open_streams_lock = threading.Lock()
+
+
+def format_event(event: str, data: dict[str, object]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@tasks_blueprint.get("/stream/<id>")
+def task_stream(id: str) -> Response:
+    """
+    Streams the task's progress ("progress" events) and its result (a final "result" event) as
+    Server-Sent Events, instead of having the client poll `/result/<id>`.
+    """
+    global open_streams
+
+    timeout = current_app.config["TASK_STREAM_TIMEOUT"]
+    keepalive = current_app.config["TASK_STREAM_KEEPALIVE"]
+
+    # Each stream holds a worker thread (or greenlet) while it is open. Once the process has no
+    # more to spare, clients are refused and poll `/result/<id>` instead.
+    with open_streams_lock:
+        if open_streams >= current_app.config["TASK_STREAM_MAX_CONNECTIONS"]:
+            return Response(status=503, headers={"Retry-After": "1"})
+        open_streams += 1
+
+    def close():
+        global open_streams
+
+        pubsub.close()
+        with open_streams_lock:
+            open_streams -= 1
+
+    # Subscribe before reading the current state, so that no event is missed in between
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(task_events_channel(id))
+    except Exception:
+        close()
+        raise
+
+    def stream():
+        # Clients reconnect after this many milliseconds if the stream ends early
+        yield "retry: 1000\n\n"
+
+        response = get_task_response(id)
+        if response["ready"]:
+            yield format_event("result", response)
+            return
+        yield format_event("progress", response)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=keepalive)
+            if message is None:
+                # Keeps proxies from closing the idle connection
+                yield ": keepalive\n\n"
+                continue
+
+            event = json.loads(message["data"])
+            if event["state"] in states.READY_STATES:
+                yield format_event("result", get_task_response(id))
+                return
+
+            yield format_event(
+                "progress",
+                {
+                    "ready": False,
+                    "successful": False,
+                    "state": event["state"],
+                    "value": None,
+                    "progress": event["meta"],
+                },
+            )
+
+    response = Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Also called when the client disconnects before the stream started
+    response.call_on_close(close)
     return response
+
+
+@tasks_blueprint.get("/stats/response-cache")
+def response_cache_stats() -> dict[str, object]:
+    return get_response_cache().stats()
+
+
+@tasks_blueprint.get("/queues")
+def queue_stats() -> dict[str, object]:
+    """
+    Returns the depth and wait times of each queue of the quiz generation tasks.
+    """
+    sep = current_app.config["CELERY"]["broker_transport_options"]["sep"]
+    return get_fair_scheduler().lane_stats(sep)
@@ -0,0 +1,370 @@
+"""
+Benchmarks the quiz generation pipeline on synthetic PDF, docx, md and txt documents of several
+sizes, with the stub LLM provider, and prints the time and peak memory of each stage as JSON:
+load, language_detection, segmenting, generation and (with --task) persist.
+
+The documents and the stub's answers are generated from --seed, so runs are reproducible and
+their results can be compared across versions.
+
+Usage (from the backend directory):
+    python scripts/benchmark.py [--formats pdf,docx,md,txt] [--sizes 5,50,200] [--questions 10]
+        [--repeat 3] [--latency 0] [--task] [--output results.json]
+
+--task also runs `tasks.create_quiz` end to end, in this process, which needs the database and
+Redis of the configuration. The quizzes it creates are deleted afterwards.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict, List
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import Quiz, Subject
+from util.quizgpt.index import QuizGPT
+from util.quizgpt.providers import StubProvider
+
+WORDS = """
+cell energy protein membrane molecule enzyme reaction organism structure function
+system process theory evidence experiment variable result analysis pressure temperature
+force motion velocity mass current circuit voltage resistance market price demand supply
+economy policy history empire revolution treaty culture language society population
+climate ocean mountain river species habitat evolution genetics inheritance mutation
+""".split()
+
+PARAGRAPHS_PER_PAGE = 4
+SENTENCES_PER_PARAGRAPH = 6
+
+
+def generate_pages(pages: int, seed: int) -> List[List[str]]:
+    """
+    Returns the paragraphs of every page of a synthetic English document.
+    """
+    rng = random.Random(seed)
+
+    def sentence() -> str:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+        return " ".join(words).capitalize() + "."
+
+    return [
+        [
+            " ".join(sentence() for _ in range(SENTENCES_PER_PARAGRAPH))
+            for _ in range(PARAGRAPHS_PER_PAGE)
+        ]
+        for _ in range(pages)
+    ]
+
+
+def write_txt(path: str, pages: List[List[str]]) -> None:
+    with open(path, "w") as f:
+        f.write("\n\n".join("\n\n".join(paragraphs) for paragraphs in pages))
+
+
+def write_md(path: str, pages: List[List[str]]) -> None:
+    with open(path, "w") as f:
+        for i, paragraphs in enumerate(pages):
+            f.write(f"# Chapter {i + 1}\n\n")
+            f.write("\n\n".join(paragraphs))
+            f.write("\n\n")
+
+
+def _wrap(text: str, width: int = 90) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def write_pdf(path: str, pages: List[List[str]]) -> None:
+    """
+    Writes a minimal PDF with a page of Helvetica text per page.
+    """
+
+    def pdf_string(text: str) -> str:
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    # Catalog, pages and font, then a page and its content for every page
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (" ".join(f"{4 + i * 2} 0 R" for i in range(len(pages))), len(pages)),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, paragraphs in enumerate(pages):
+        lines = []
+        for paragraph in paragraphs:
+            lines += _wrap(paragraph) + [""]
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td %s ET" % " ".join(
+            f"({pdf_string(line)}) Tj T*" for line in lines
+        )
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + i * 2} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for i, body in enumerate(objects):
+            offsets.append(f.tell())
+            f.write(f"{i + 1} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode())
+        f.write(
+            f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n".encode()
+        )
+
+
+def write_docx(path: str, pages: List[List[str]]) -> None:
+    """
+    Writes a minimal docx with a paragraph per paragraph, and page breaks between pages.
+    """
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        "</Types>"
+    )
+    relationships = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="word/document.xml"/>'
+        "</Relationships>"
+    )
+    body = []
+    for i, paragraphs in enumerate(pages):
+        if i:
+            body.append('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+        for paragraph in paragraphs:
+            body.append(
+                f'<w:p><w:r><w:t xml:space="preserve">{escape(paragraph)}</w:t></w:r></w:p>'
+            )
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{''.join(body)}</w:body></w:document>"
+    )
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as f:
+        f.writestr("[Content_Types].xml", content_types)
+        f.writestr("_rels/.rels", relationships)
+        f.writestr("word/document.xml", document)
+
+
+WRITERS = {"pdf": write_pdf, "docx": write_docx, "md": write_md, "txt": write_txt}
+
+
+class NullTask:
+    """
+    Stands in for the Celery task QuizGPT reports its progress to.
+    """
+
+    def update_state(self, *args, **kwargs) -> None:
+        pass
+
+
+def run_quiz_gpt(path: str, args: argparse.Namespace) -> dict:
+    """
+    Generates the questions of the file with QuizGPT, and returns its stage timings and peaks.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    quiz_gpt = QuizGPT(
+        openai_api_key="benchmark",
+        celery_task=NullTask(),
+        files=[path],
+        max_concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        max_segment_tokens=args.segment_tokens,
+        provider=StubProvider(latency=args.latency, seed=args.seed),
+    )
+    try:
+        questions, response_code, _ = quiz_gpt.generate_questions(args.questions)
+    finally:
+        quiz_gpt.close()
+    total = time.perf_counter() - start
+    peak = max([tracemalloc.get_traced_memory()[1], *quiz_gpt.peak_memory.values()])
+    tracemalloc.stop()
+
+    return {
+        "total_seconds": total,
+        "stage_seconds": quiz_gpt.timings,
+        "stage_peak_bytes": quiz_gpt.peak_memory,
+        "peak_bytes": peak,
+        "pages": quiz_gpt.page_count,
+        "questions": len(questions),
+        "response_code": response_code,
+    }
+
+
+def run_task(path: str, subject_id: int, args: argparse.Namespace) -> dict:
+    """
+    Runs `tasks.create_quiz` on a copy of the file (the task removes its files), and deletes the
+    created quiz.
+    """
+    import tasks
+
+    upload = tempfile.NamedTemporaryFile(suffix=os.path.splitext(path)[1], delete=False)
+    upload.close()
+    shutil.copyfile(path, upload.name)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = tasks.create_quiz.apply(
+        args=[
+            "benchmark",
+            subject_id,
+            "Benchmark",
+            50,
+            "",
+            10,
+            args.questions,
+            [upload.name],
+        ],
+        kwargs={"user_ip": "benchmark", "use_response_cache": False},
+    ).get()
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    if result.get("quiz_id"):
+        db.session.delete(db.session.get(Quiz, result["quiz_id"]))
+        db.session.commit()
+
+    details = result["details"]
+    return {
+        "total_seconds": total,
+        "stage_seconds": details.get("timings", {}),
+        "insert_ms": details.get("insert_time_ms"),
+        "peak_bytes": peak,
+        "response_code": details["response_code"],
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--formats", default="pdf,docx,md,txt")
+    parser.add_argument("--sizes", default="5,50,200", help="Pages of each document")
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub LLM latency")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--segment-tokens", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--task", action="store_true", help="Also run tasks.create_quiz"
+    )
+    parser.add_argument(
+        "--output", help="Write the results to this file instead of stdout"
+    )
+    args = parser.parse_args()
+
+    formats = args.formats.split(",")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    corpus_directory = tempfile.mkdtemp(prefix="quizgpt-benchmark-")
+
+    # The task builds its own QuizGPT from the configuration
+    app.config.update(
+        LLM_PROVIDER="stub",
+        STUB_LLM_LATENCY=args.latency,
+        STUB_LLM_LATENCY_JITTER=0.0,
+        STUB_LLM_SEED=args.seed,
+        PARSE_CACHE_ENABLED=False,
+        QUIZ_GENERATION_MODE="local",
+    )
+
+    results: List[Dict[str, object]] = []
+    try:
+        with app.app_context():
+            subject_id = None
+            if args.task:
+                subject = Subject(title="Benchmark")
+                db.session.add(subject)
+                db.session.commit()
+                subject_id = subject.id
+
+            for size in sizes:
+                pages = generate_pages(size, args.seed)
+                for file_format in formats:
+                    path = os.path.join(corpus_directory, f"{size}.{file_format}")
+                    WRITERS[file_format](path, pages)
+
+                    for run in range(args.repeat):
+                        result = {
+                            "format": file_format,
+                            "size": size,
+                            "bytes": os.path.getsize(path),
+                            "run": run,
+                            "quiz_gpt": run_quiz_gpt(path, args),
+                        }
+                        if args.task:
+                            result["task"] = run_task(path, subject_id, args)
+                        results.append(result)
+                        print(
+                            f"{file_format} {size} pages, run {run}: "
+                            f"{result['quiz_gpt']['total_seconds']:.3f}s",
+                            file=sys.stderr,
+                        )
+
+            if subject_id:
+                db.session.delete(db.session.get(Subject, subject_id))
+                db.session.commit()
+    finally:
+        shutil.rmtree(corpus_directory, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": vars(args),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
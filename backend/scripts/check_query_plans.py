@@ -0,0 +1,382 @@
+"""
+Checks that the queries of the API's hot paths are served by indexes. Seeds a large dataset,
+sends requests to the quizzing endpoints with Flask's test client, records the queries they run
+and runs them again with EXPLAIN ANALYZE (in transactions that are rolled back), with the
+planner's normal settings. Exits with 1 if a plan scans rows only to discard them (more than
+--max-rows-removed rows removed by a filter), or does not use the index expected for its
+endpoint (`EXPECTED_INDEXES`).
+
+The lookups of the foreign key checks (e.g. of `user_choice.choice_id` when answers are
+deleted) are run by triggers, which are not recorded, and are not checked.
+
+Run it against a scratch database: the seeded rows are deleted afterwards, but seeding and
+deleting them takes a while.
+
+Usage (from the backend directory):
+    python scripts/check_query_plans.py [--quizzes 20000] [--questions 10] [--answers 4]
+        [--subjects 20000] [--max-rows-removed 1000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, event, insert, select, text
+from app import app, db
+from models import Answer, Question, Quiz, QuizAttempt, Subject, UserChoice
+
+# User IP of the seeded quizzes and prefix of the seeded subjects' titles
+MARKER = "query-plan-check"
+BATCH_SIZE = 1000
+LANGUAGES = ["en", "de", "fr", "es", "it"]
+WORDS = """
+algebra anatomy biology calculus chemistry circuits ecology economics electricity energy
+evolution finance fractions genetics geography geometry grammar history immunology law
+literature logic marketing mechanics medicine metabolism microbiology music networks neurons
+nutrition optics philosophy photosynthesis physics planets poetry probability programming
+psychology quantum revolution sociology statistics thermodynamics trigonometry vocabulary
+""".split()
+
+# Indexes the queries of an endpoint must use, the plans of other endpoints are only checked
+# for the rows they discard
+EXPECTED_INDEXES = {
+    "GET subjects search": {"ix_subject_title_trgm"},
+    "GET quizzes of subject": {"ix_quiz_shared_subject_id_language_id"},
+    "GET quizzes of language": {"ix_quiz_shared_language_id"},
+    "GET quizzes of subject and language": {"ix_quiz_shared_subject_id_language_id"},
+    "GET quizzes search": {"ix_quiz_search_vector"},
+    "GET quizzes search of language": {"ix_quiz_search_vector"},
+    "GET quiz": {"ix_question_quiz_id", "ix_answer_question_id"},
+    "GET quiz attempt": {"ix_user_choice_quiz_attempt_id", "ix_question_quiz_id"},
+    "DELETE quiz": {
+        "ix_user_choice_question_id",
+        "ix_answer_question_id",
+        "ix_question_quiz_id",
+        "ix_quiz_attempt_quiz_id",
+    },
+    "DELETE subject": {"ix_quiz_subject_id"},
+}
+
+
+class QueryRecorder:
+    """
+    Records the statements the engine runs, with their parameters, to explain them afterwards.
+    """
+
+    def __init__(self) -> None:
+        self.statements: List[Tuple[str, object]] = []
+
+    def __call__(
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        if executemany:
+            return
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            self.statements.append((statement, parameters))
+
+
+def seed(quizzes: int, questions: int, answers: int, subjects: int) -> None:
+    rng = random.Random(0)
+    start = time.perf_counter()
+
+    subject_ids = db.session.scalars(
+        insert(Subject).returning(Subject.id, sort_by_parameter_order=True),
+        [{"title": f"{MARKER} {rng.choice(WORDS)} {i}"} for i in range(subjects)],
+    ).all()
+
+    for batch_start in range(0, quizzes, BATCH_SIZE):
+        batch = range(batch_start, min(batch_start + BATCH_SIZE, quizzes))
+        quiz_ids = db.session.scalars(
+            insert(Quiz).returning(Quiz.id, sort_by_parameter_order=True),
+            [
+                {
+                    "title": " ".join(rng.sample(WORDS, 3)).capitalize(),
+                    "description": " ".join(rng.sample(WORDS, 12)),
+                    "success_percentage": 50,
+                    "duration": 600,
+                    "subject_id": rng.choice(subject_ids),
+                    "user_ip": MARKER,
+                    "is_shared": rng.random() < 0.8,
+                    "language": rng.choice(LANGUAGES),
+                    "is_quiz_buddy_original": False,
+                    "question_count": questions,
+                }
+                for _ in batch
+            ],
+        ).all()
+
+        question_ids = db.session.scalars(
+            insert(Question).returning(Question.id, sort_by_parameter_order=True),
+            [
+                {"title": f"Question {i + 1}", "quiz_id": quiz_id}
+                for quiz_id in quiz_ids
+                for i in range(questions)
+            ],
+        ).all()
+
+        answer_ids = db.session.scalars(
+            insert(Answer).returning(Answer.id, sort_by_parameter_order=True),
+            [
+                {
+                    "title": f"Answer {i + 1}",
+                    "is_correct": i == 0,
+                    "question_id": question_id,
+                }
+                for question_id in question_ids
+                for i in range(answers)
+            ],
+        ).all()
+
+        # An attempt of every fourth quiz, answering its questions with their first answer
+        attempted = list(range(0, len(quiz_ids), 4))
+        attempt_ids = db.session.scalars(
+            insert(QuizAttempt).returning(QuizAttempt.id, sort_by_parameter_order=True),
+            [
+                {"quiz_id": quiz_ids[i], "result": 100, "did_pass": True}
+                for i in attempted
+            ],
+        ).all()
+        choices = [
+            {
+                "question_id": question_ids[i * questions + j],
+                "choice_id": (
+                    answer_ids[(i * questions + j) * answers] if answers else None
+                ),
+                "quiz_attempt_id": attempt_id,
+            }
+            for attempt_id, i in zip(attempt_ids, attempted)
+            for j in range(questions)
+        ]
+        if choices:
+            db.session.execute(insert(UserChoice), choices)
+
+    db.session.commit()
+
+    # Up to date statistics, for the planner to cost the plans like in production
+    for table in [
+        "subject",
+        "quiz",
+        "question",
+        "answer",
+        "quiz_attempt",
+        "user_choice",
+    ]:
+        db.session.execute(text(f"ANALYZE {table}"))
+    db.session.commit()
+
+    print(
+        f"Seeded {quizzes} quizzes of {questions} questions of {answers} answers "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+def cleanup() -> None:
+    quiz_ids = select(Quiz.id).where(Quiz.user_ip == MARKER)
+    attempt_ids = select(QuizAttempt.id).where(QuizAttempt.quiz_id.in_(quiz_ids))
+    question_ids = select(Question.id).where(Question.quiz_id.in_(quiz_ids))
+
+    db.session.execute(
+        delete(UserChoice).where(UserChoice.quiz_attempt_id.in_(attempt_ids))
+    )
+    db.session.execute(delete(QuizAttempt).where(QuizAttempt.quiz_id.in_(quiz_ids)))
+    db.session.execute(delete(Answer).where(Answer.question_id.in_(question_ids)))
+    db.session.execute(delete(Question).where(Question.quiz_id.in_(quiz_ids)))
+    db.session.execute(delete(Quiz).where(Quiz.user_ip == MARKER))
+    db.session.execute(delete(Subject).where(Subject.title.startswith(MARKER)))
+    db.session.commit()
+
+
+def get_requests() -> List[Tuple[str, str, str, Optional[dict]]]:
+    """
+    Returns the requests to check, as (name, method, URL, JSON body), on seeded rows.
+    """
+    shared = db.session.scalars(
+        select(Quiz).where(Quiz.user_ip == MARKER, Quiz.is_shared).limit(1)
+    ).one()
+    private = db.session.scalars(
+        select(Quiz).where(Quiz.user_ip == MARKER, Quiz.is_shared == False).limit(1)
+    ).one()
+    attempt = db.session.scalars(
+        select(QuizAttempt)
+        .where(QuizAttempt.quiz_id.in_(select(Quiz.id).where(Quiz.user_ip == MARKER)))
+        .limit(1)
+    ).one()
+    attempted_quiz = db.session.get(Quiz, attempt.quiz_id)
+    # Deleted by the checks, so not one of the others'
+    deleted = db.session.scalars(
+        select(Quiz)
+        .where(
+            Quiz.user_ip == MARKER,
+            Quiz.id.not_in([shared.id, private.id, attempted_quiz.id]),
+        )
+        .limit(1)
+    ).one()
+    empty_subject = Subject(title=f"{MARKER} empty")
+    db.session.add(empty_subject)
+    db.session.commit()
+
+    word = shared.title.split()[0].lower()
+    answered_questions = [
+        {"question_id": q.id, "choice_id": q.answers[0].id if q.answers else None}
+        for q in attempted_quiz.questions
+    ]
+
+    quizzes = "/api/quizzing/quizzes"
+    subjects = "/api/quizzing/subjects"
+    return [
+        ("GET subjects", "GET", subjects, None),
+        ("GET subjects search", "GET", f"{subjects}?search_query={word}", None),
+        ("GET subject", "GET", f"{subjects}/{shared.subject_id}", None),
+        ("GET quizzes", "GET", quizzes, None),
+        (
+            "GET quizzes of subject",
+            "GET",
+            f"{quizzes}?subject_id={shared.subject_id}",
+            None,
+        ),
+        (
+            "GET quizzes of language",
+            "GET",
+            f"{quizzes}?language={shared.language}",
+            None,
+        ),
+        (
+            "GET quizzes of subject and language",
+            "GET",
+            f"{quizzes}?subject_id={shared.subject_id}&language={shared.language}",
+            None,
+        ),
+        ("GET quizzes search", "GET", f"{quizzes}?search_query={word}", None),
+        (
+            "GET quizzes search of language",
+            "GET",
+            f"{quizzes}?search_query={word}&language={shared.language}",
+            None,
+        ),
+        ("GET quiz", "GET", f"{quizzes}/{shared.id}", None),
+        (
+            "POST quiz attempt",
+            "POST",
+            f"{quizzes}/{attempted_quiz.id}/attempt",
+            {"answered_questions": answered_questions},
+        ),
+        (
+            "GET quiz attempt",
+            "GET",
+            f"{quizzes}/{attempted_quiz.id}/attempts/{attempt.id}",
+            None,
+        ),
+        ("PUT share quiz", "PUT", f"{quizzes}/{private.id}/share", None),
+        ("DELETE quiz", "DELETE", f"{quizzes}/{deleted.id}", None),
+        ("DELETE subject", "DELETE", f"{subjects}/{empty_subject.id}", None),
+    ]
+
+
+def walk_plan(plan: dict) -> Iterator[dict]:
+    """
+    Yields the nodes of an EXPLAIN plan.
+    """
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk_plan(child)
+
+
+def rows_removed(node: dict) -> int:
+    """
+    Returns the number of rows the node read and discarded, over all its loops.
+    """
+    removed = node.get("Rows Removed by Filter", 0) + node.get(
+        "Rows Removed by Index Recheck", 0
+    )
+    return int(removed * node.get("Actual Loops", 1))
+
+
+def check_query_plans(max_rows_removed: int) -> bool:
+    client = app.test_client()
+    headers = {"X-Forwarded-For": MARKER}
+    recorded: Dict[str, List[Tuple[str, object]]] = {}
+
+    requests = get_requests()
+    recorder = QueryRecorder()
+    event.listen(db.engine, "before_cursor_execute", recorder)
+    try:
+        for name, method, url, body in requests:
+            recorder.statements = []
+            response = client.open(url, method=method, json=body, headers=headers)
+            if response.status_code >= 400:
+                raise RuntimeError(
+                    f"{name} failed with {response.status_code}: {response.data}"
+                )
+
+            # Also checks the next page, which filters on the cursor
+            next_cursor = (response.get_json() or {}).get("next_cursor")
+            if method == "GET" and next_cursor:
+                separator = "&" if "?" in url else "?"
+                client.get(f"{url}{separator}cursor={next_cursor}", headers=headers)
+
+            recorded[name] = recorder.statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", recorder)
+
+    ok = True
+    with db.engine.connect() as connection:
+        for name, statements in recorded.items():
+            failures = []
+            used_indexes = set()
+            for statement, parameters in statements:
+                # EXPLAIN ANALYZE runs the statement, the changes of the writes are rolled back
+                transaction = connection.begin()
+                try:
+                    plan = connection.exec_driver_sql(
+                        f"EXPLAIN (ANALYZE, FORMAT JSON) {statement}", parameters
+                    ).scalar()
+                finally:
+                    transaction.rollback()
+
+                for node in walk_plan(plan[0]["Plan"]):
+                    if "Index Name" in node:
+                        used_indexes.add(node["Index Name"])
+                    removed = rows_removed(node)
+                    if removed > max_rows_removed:
+                        target = node.get("Index Name") or node.get("Relation Name")
+                        failures.append(
+                            f"{node['Node Type']} of {target} discards {removed} rows: "
+                            + " ".join(statement.split())
+                        )
+
+            for index in sorted(EXPECTED_INDEXES.get(name, set()) - used_indexes):
+                failures.append(f"{index} is not used")
+
+            print(f"{'FAIL' if failures else 'ok'}  {name} ({len(statements)} queries)")
+            for failure in failures:
+                ok = False
+                print(f"      {failure}")
+
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks that the API's queries are served by indexes"
+    )
+    parser.add_argument("--quizzes", type=int, default=20000)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--answers", type=int, default=4)
+    parser.add_argument("--subjects", type=int, default=20000)
+    parser.add_argument("--max-rows-removed", type=int, default=1000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.quizzes, args.questions, args.answers, args.subjects)
+        try:
+            ok = check_query_plans(args.max_rows_removed)
+        finally:
+            db.session.rollback()
+            cleanup()
+
+    sys.exit(0 if ok else 1)
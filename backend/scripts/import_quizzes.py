@@ -0,0 +1,82 @@
+"""
+Imports the Quiz Buddy original quizzes of a JSON file (`quizzes_data.json` by default, see
+`temp.js` for its shape) in a single transaction, with bulk inserts.
+
+Usage (from the backend directory): python scripts/import_quizzes.py [path/to/quizzes.json]
+"""
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import Quiz, Subject
+from util.persistence import AnswerData, QuestionData, bulk_insert_questions
+
+DEFAULT_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "quizzes_data.json"
+)
+
+
+def import_quizzes(path: str) -> None:
+    with open(path) as f:
+        quizzes_data = json.load(f)
+
+    start = time.perf_counter()
+    question_count = 0
+    try:
+        subjects = {}
+        for data in quizzes_data:
+            subject = subjects.get(data["subject"])
+            if subject is None:
+                subject = Subject.query.filter_by(title=data["subject"]).first()
+                if subject is None:
+                    subject = Subject(title=data["subject"])
+                    db.session.add(subject)
+                subjects[data["subject"]] = subject
+
+            quiz = Quiz(
+                subject=subject,
+                title=data["quiz"],
+                success_percentage=int(data["successPercentage"]),
+                description=data.get("description"),
+                duration=int(data["duration"]),
+                user_ip="",
+                is_shared=True,
+                language=data.get("language", "en"),
+                is_quiz_buddy_original=True,
+            )
+            questions = [
+                QuestionData(
+                    title=q["title"],
+                    answers=[
+                        AnswerData(a["title"], a["isCorrect"]) for a in q["answers"]
+                    ],
+                )
+                for q in data["questions"]
+            ]
+            quiz.question_count = len(questions)
+            db.session.add(quiz)
+            # Assigns the IDs of the quiz and its subject
+            db.session.flush()
+
+            bulk_insert_questions(quiz.id, questions)
+            question_count += len(questions)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Imported {len(quizzes_data)} quizzes and {question_count} questions in {elapsed * 1000:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        import_quizzes(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FILE)
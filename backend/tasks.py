@@ -1,24 +1,226 @@
-from celery import shared_task
-from typing import List
-from models import Quiz, Question, Answer
-from app import db
+import time
+import redis
+from celery import chord, shared_task, states
+from celery.exceptions import Ignore
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from typing import Dict, List, Optional, Tuple
+from langchain_core.exceptions import OutputParserException
+from sqlalchemy.exc import OperationalError
+from models import Quiz
+from app import db, app
 from util.index import remove_files
-from util.quizgpt.index import QuizGPT
+from util.persistence import AnswerData, QuestionData, save_quiz_with_questions
+from util.quizgpt.checkpoint import GenerationCheckpoint
+from util.quizgpt.index import (
+    TOO_SHORT_MESSAGE,
+    FileParsingError,
+    QuizGPT,
+    summarize_questions,
+)
+from util.quizgpt.index import Question as GeneratedQuestion
+from util.quizgpt.parse_cache import ParseCache
+from util.quizgpt.providers import LLMProvider, StubProvider, get_openai_provider
+from util.quizgpt.rate_limiter import (
+    OpenAIRateLimiter,
+    RateLimitTimeout,
+    is_retryable_error,
+)
+from util.quizgpt.response_cache import ResponseCache
+from util.redis_client import get_redis
+from util.scheduling import FairScheduler
+from util.single_flight import SingleFlight
+from util.storage import get_upload_storage
 
 
-@shared_task(bind=True, ignore_result=False)
-def create_quiz(
-    self,
+def is_transient_error(error: Exception) -> bool:
+    """
+    Returns whether retrying the task may get past the error: OpenAI rate limits, timeouts and
+    server errors, malformed GPT answers, and connection errors of the database or Redis.
+    """
+    if is_retryable_error(error):
+        return True
+    return isinstance(
+        error,
+        (
+            RateLimitTimeout,
+            OutputParserException,
+            OperationalError,
+            redis.ConnectionError,
+            redis.TimeoutError,
+            ConnectionError,
+            TimeoutError,
+        ),
+    )
+
+
+def get_parse_cache() -> Optional[ParseCache]:
+    """
+    Returns the parse cache of the worker, or None if it is disabled.
+    """
+    if not app.config["PARSE_CACHE_ENABLED"]:
+        return None
+
+    return ParseCache(
+        directory=app.config["PARSE_CACHE_DIR"],
+        max_bytes=app.config["PARSE_CACHE_MAX_BYTES"],
+    )
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Returns the cache of generated questions shared by the workers.
+    """
+    return ResponseCache(
+        client=get_redis(),
+        ttl=app.config["RESPONSE_CACHE_TTL"],
+        max_entries=app.config["RESPONSE_CACHE_MAX_ENTRIES"],
+    )
+
+
+def get_rate_limiter() -> Optional[OpenAIRateLimiter]:
+    """
+    Returns the rate limiter of the OpenAI requests shared by the workers, or None if it is disabled.
+    """
+    if not app.config["OPENAI_RATE_LIMIT_ENABLED"]:
+        return None
+
+    return OpenAIRateLimiter(
+        client=get_redis(),
+        requests_per_minute=app.config["OPENAI_REQUESTS_PER_MINUTE"],
+        tokens_per_minute=app.config["OPENAI_TOKENS_PER_MINUTE"],
+        max_retries=app.config["OPENAI_MAX_RETRIES"],
+        backoff_base=app.config["OPENAI_BACKOFF_BASE"],
+        backoff_max=app.config["OPENAI_BACKOFF_MAX"],
+        failure_threshold=app.config["OPENAI_CIRCUIT_FAILURE_THRESHOLD"],
+        cooldown=app.config["OPENAI_CIRCUIT_COOLDOWN"],
+    )
+
+
+def get_llm_provider(
+    openai_api_key: str, rate_limiter: Optional[OpenAIRateLimiter]
+) -> LLMProvider:
+    """
+    Returns the provider of the language model configured by `LLM_PROVIDER`.
+    """
+    if app.config["LLM_PROVIDER"] == "stub":
+        return StubProvider(
+            latency=app.config["STUB_LLM_LATENCY"],
+            latency_jitter=app.config["STUB_LLM_LATENCY_JITTER"],
+            failure_rate=app.config["STUB_LLM_FAILURE_RATE"],
+            too_short_rate=app.config["STUB_LLM_TOO_SHORT_RATE"],
+            seed=app.config["STUB_LLM_SEED"],
+        )
+
+    return get_openai_provider(openai_api_key, rate_limited=rate_limiter is not None)
+
+
+def get_checkpoint(quiz_task_id: str) -> GenerationCheckpoint:
+    """
+    Returns the checkpoint of the questions generated for the quiz of the task.
+    """
+    return GenerationCheckpoint(
+        client=get_redis(),
+        task_id=quiz_task_id,
+        ttl=app.config["QUIZ_CHECKPOINT_TTL"],
+    )
+
+
+def build_quiz_gpt(
+    task,
     openai_api_key: str,
+    files: List[str],
+    use_response_cache: bool,
+    checkpoint: GenerationCheckpoint,
+    language: Optional[str] = None,
+) -> QuizGPT:
+    rate_limiter = get_rate_limiter()
+    storage = get_upload_storage()
+    return QuizGPT(
+        openai_api_key=openai_api_key,
+        celery_task=task,
+        files=[storage.local_path(file) for file in files],
+        max_concurrency=app.config["QUIZGPT_MAX_CONCURRENCY"],
+        batch_size=app.config["QUIZGPT_BATCH_SIZE"],
+        language_detection_threshold=app.config["QUIZGPT_LANGUAGE_DETECTION_THRESHOLD"],
+        parse_cache=get_parse_cache(),
+        max_segment_tokens=app.config["QUIZGPT_SEGMENT_MAX_TOKENS"],
+        parse_workers=app.config["QUIZGPT_PARSE_WORKERS"],
+        checkpoint=checkpoint,
+        language=language,
+        rate_limiter=rate_limiter,
+        provider=get_llm_provider(openai_api_key, rate_limiter),
+        response_cache=(
+            get_response_cache()
+            if use_response_cache and app.config["RESPONSE_CACHE_ENABLED"]
+            else None
+        ),
+    )
+
+
+def quiz_error_result(response_message: str, response_code) -> dict:
+    return {
+        "message": "Error during quiz creation",
+        "quiz_id": None,
+        "details": {
+            "response_message": response_message,
+            "response_code": response_code,
+        },
+    }
+
+
+def quiz_created_result(
+    quiz_id: int,
+    response_message: str,
+    response_code,
+    insert_time: Optional[float] = None,
+    timings: Optional[Dict[str, float]] = None,
+) -> dict:
+    result = {
+        "message": "Quiz created successfully.",
+        "quiz_id": quiz_id,
+        "details": {
+            "response_message": response_message,
+            "response_code": response_code,
+        },
+    }
+    if insert_time is not None:
+        result["details"]["insert_time_ms"] = round(insert_time * 1000, 2)
+    if timings is not None:
+        # Seconds spent in each stage of the generation
+        result["details"]["timings"] = {
+            stage: round(seconds, 4) for stage, seconds in timings.items()
+        }
+    return result
+
+
+def existing_quiz_result(quiz_task_id: str) -> Optional[dict]:
+    """
+    Returns the result of the quiz already persisted by an earlier delivery of the task, if any.
+    """
+    existing_quiz = Quiz.query.filter_by(task_id=quiz_task_id).first()
+    if not existing_quiz:
+        return None
+
+    return quiz_created_result(
+        existing_quiz.id, "All questions were successfully generated.", "success"
+    )
+
+
+def save_quiz(
+    quiz_task_id: str,
     subject_id: int,
     title: str,
     success_percentage: int,
     description: str,
     duration: int,
-    number_of_questions: int,
-    created_files_paths: List[str],
     user_ip: str,
-):
+    language_code: str,
+    questions: List[GeneratedQuestion],
+) -> Tuple[Quiz, float]:
+    """
+    Persists the quiz with its questions and answers, and returns it with the time spent inserting
+    them, in seconds.
+    """
     quiz = Quiz(
         subject_id=subject_id,
         title=title,
@@ -27,68 +229,395 @@ def create_quiz(
         duration=duration,
         user_ip=user_ip,
         is_shared=False,  # This can be updated by the user later
+        task_id=quiz_task_id,
+        language=language_code,
+    )
+
+    # Save the questions and answers to the database
+    insert_time = save_quiz_with_questions(
+        quiz,
+        [
+            QuestionData(
+                title=q.title,
+                answers=[AnswerData(a.title, a.is_correct) for a in q.answers],
+            )
+            for q in questions
+        ],
     )
+    print(f"Inserted {len(questions)} questions in {insert_time * 1000:.2f}ms")
+    return quiz, insert_time
+
+
+def progress_key(quiz_task_id: str) -> str:
+    return f"quizgpt:progress:{quiz_task_id}"
+
+
+def abort_key(quiz_task_id: str) -> str:
+    return f"quizgpt:abort:{quiz_task_id}"
 
+
+def deliveries_key(quiz_task_id: str) -> str:
+    return f"quizgpt:deliveries:{quiz_task_id}"
+
+
+def count_delivery(quiz_task_id: str) -> int:
+    """
+    Counts a delivery of the quiz's task, retries included, and returns the number of deliveries
+    so far. The count is kept as long as the task's checkpoint.
+    """
+    pipeline = get_redis().pipeline(transaction=False)
+    pipeline.incr(deliveries_key(quiz_task_id))
+    pipeline.expire(deliveries_key(quiz_task_id), app.config["QUIZ_CHECKPOINT_TTL"])
+    return pipeline.execute()[0]
+
+
+# The message is only acknowledged once the task finishes, so a task interrupted by a lost worker
+# is delivered again. It then resumes from its checkpoint, and never persists its quiz twice. It
+# fails for good once it was delivered again more than QUIZ_MAX_REDELIVERIES times.
+@shared_task(
+    bind=True,
+    ignore_result=False,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=3,
+)
+def create_quiz(
+    self,
+    openai_api_key: str,
+    subject_id: int,
+    title: str,
+    success_percentage: int,
+    description: str,
+    duration: int,
+    number_of_questions: int,
+    created_files_paths: List[str],
+    user_ip: str,
+    use_response_cache: bool = True,
+    single_flight_key: Optional[str] = None,
+):
+    # Already persisted by an earlier delivery of this task
+    existing_result = existing_quiz_result(self.request.id)
+    if existing_result:
+        remove_files(created_files_paths)
+        return existing_result
+
+    checkpoint = get_checkpoint(self.request.id)
+
+    redeliveries = count_delivery(self.request.id) - 1 - self.request.retries
+    if redeliveries > app.config["QUIZ_MAX_REDELIVERIES"]:
+        print(f"Quiz task {self.request.id} was delivered {redeliveries} times again")
+        checkpoint.clear()
+        remove_files(created_files_paths)
+        return quiz_error_result(
+            "The quiz generation was interrupted too many times.", 500
+        )
+
+    quiz_gpt = None
     try:
-        quiz_gpt = QuizGPT(
-            openai_api_key=openai_api_key, celery_task=self, files=created_files_paths
+        quiz_gpt = build_quiz_gpt(
+            self, openai_api_key, created_files_paths, use_response_cache, checkpoint
         )
+
+        # Fan out the questions' generation to any free worker, then persist the quiz in a final task
+        if app.config["QUIZ_GENERATION_MODE"] == "canvas":
+            segments = quiz_gpt.plan_segments(number_of_questions)
+            language_code, language_name = quiz_gpt.get_language()
+            quiz_gpt.close()
+
+            if segments is None:
+                checkpoint.clear()
+                remove_files(created_files_paths)
+                return quiz_error_result(TOO_SHORT_MESSAGE, "too-short")
+
+            get_redis().delete(
+                progress_key(self.request.id), abort_key(self.request.id)
+            )
+            workflow = chord(
+                [
+                    generate_quiz_question.s(
+                        self.request.id,
+                        openai_api_key,
+                        quiz_gpt.language,
+                        segment,
+                        number_of_questions,
+                        use_response_cache,
+                    )
+                    for segment in segments
+                ],
+                persist_quiz.s(
+                    self.request.id,
+                    subject_id,
+                    title,
+                    success_percentage,
+                    description,
+                    duration,
+                    language_code,
+                    created_files_paths,
+                    user_ip=user_ip,
+                    single_flight_key=single_flight_key,
+                ),
+            )
+            # The final task takes over this task's ID, so its result is this task's result
+            raise self.replace(workflow)
+
         questions, response_code, response_message = quiz_gpt.generate_questions(
             num_questions=number_of_questions
         )
         language_code, language_name = quiz_gpt.get_language()
+        quiz_gpt.close()
         print("Language code: ", language_code)
         print("Language name: ", language_name)
 
         # If no questions were generated
         if len(questions) <= 0:
+            checkpoint.clear()
             remove_files(created_files_paths)
-            return {
-                "message": "Error during quiz creation",
-                "quiz_id": None,
-                "details": {
-                    "response_message": response_message,
-                    "response_code": response_code,
-                },
-            }
-
-        # Save the questions and answers to the database
-        for i, q in enumerate(questions):
-            question = Question(title=q.title)
-            for a in q.answers:
-                answer = Answer(title=a.title, is_correct=a.is_correct)
-                question.answers.append(answer)
-            quiz.questions.append(question)
-
-        # Save the quiz's language
-        quiz.language = language_code
-
-        db.session.add(quiz)
-        db.session.commit()
+            return quiz_error_result(response_message, response_code)
+
+        quiz, insert_time = save_quiz(
+            self.request.id,
+            subject_id,
+            title,
+            success_percentage,
+            description,
+            duration,
+            user_ip,
+            language_code,
+            questions,
+        )
+        checkpoint.clear()
         remove_files(created_files_paths)
 
-        return {
-            "message": "Quiz created successfully.",
-            "quiz_id": quiz.id,
-            "details": {
-                "response_message": response_message,
-                "response_code": response_code,
-            },
-        }
+        return quiz_created_result(
+            quiz.id,
+            response_message,
+            response_code,
+            insert_time,
+            timings={**quiz_gpt.timings, "persist": insert_time},
+        )
 
-    except Exception as e:
+    except Ignore:
+        # Replaced by the fan out workflow
+        raise
+
+    except FileParsingError as e:
+        checkpoint.clear()
         remove_files(created_files_paths)
         print("Error during quiz creation: ", str(e))
+        return quiz_error_result(str(e), 422)
+
+    except Exception as e:
+        db.session.rollback()
+        if quiz_gpt:
+            quiz_gpt.close()
+        print("Error during quiz creation: ", str(e))
         # if error contains Incorrect API key provided
         if "Incorrect API key provided" in str(e):
             print("Incorrect API key provided")
-            return {
-                "message": "Error during quiz creation",
-                "quiz_id": None,
-                "details": {
-                    "response_message": "Incorrect API key provided",
-                    "response_code": 401,
-                },
-            }
+            checkpoint.clear()
+            remove_files(created_files_paths)
+            return quiz_error_result("Incorrect API key provided", 401)
+
+        # Retry, keeping the files and the checkpoint, so the questions generated so far are kept
+        if is_transient_error(e) and self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=10 * 2**self.request.retries)
 
+        checkpoint.clear()
+        remove_files(created_files_paths)
         raise Exception(e)
+
+
+@shared_task(
+    bind=True,
+    ignore_result=False,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=3,
+)
+def generate_quiz_question(
+    self,
+    quiz_task_id: str,
+    openai_api_key: str,
+    language: str,
+    segment: str,
+    number_of_questions: int,
+    use_response_cache: bool = True,
+):
+    """
+    Generates the question of a single segment of the quiz of `quiz_task_id`, and reports the
+    quiz's progress. Errors are returned rather than raised, so that the quiz is still persisted
+    (or cleaned up) by `persist_quiz`.
+    """
+    client = get_redis()
+
+    # Another segment was too short, there is no point in generating this one
+    if client.exists(abort_key(quiz_task_id)):
+        return None
+
+    try:
+        quiz_gpt = build_quiz_gpt(
+            self,
+            openai_api_key,
+            [],
+            use_response_cache,
+            get_checkpoint(quiz_task_id),
+            language=language,
+        )
+        question = quiz_gpt.generate_segment_question(segment)
+    except Exception as e:
+        print("Error during question generation: ", str(e))
+        if "Incorrect API key provided" in str(e):
+            client.set(abort_key(quiz_task_id), 1, ex=app.config["QUIZ_CHECKPOINT_TTL"])
+            return {"error": "Incorrect API key provided"}
+
+        if is_transient_error(e) and self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=10 * 2**self.request.retries)
+
+        return {"error": str(e)}
+
+    if not question.success and "too short" in question.message:
+        client.set(abort_key(quiz_task_id), 1, ex=app.config["QUIZ_CHECKPOINT_TTL"])
+
+    pipeline = client.pipeline(transaction=False)
+    pipeline.incr(progress_key(quiz_task_id))
+    pipeline.expire(progress_key(quiz_task_id), app.config["QUIZ_CHECKPOINT_TTL"])
+    completed = pipeline.execute()[0]
+    self.update_state(
+        task_id=quiz_task_id,
+        state="PROGRESS",
+        meta={"current": completed, "total": number_of_questions},
+    )
+
+    return {"question": question.dict()}
+
+
+@shared_task(bind=True, ignore_result=False, acks_late=True, reject_on_worker_lost=True)
+def persist_quiz(
+    self,
+    results: List[Optional[dict]],
+    quiz_task_id: str,
+    subject_id: int,
+    title: str,
+    success_percentage: int,
+    description: str,
+    duration: int,
+    language_code: str,
+    created_files_paths: List[str],
+    user_ip: str,
+    single_flight_key: Optional[str] = None,
+):
+    """
+    Persists the quiz from the results of its `generate_quiz_question` tasks.
+    """
+    existing_result = existing_quiz_result(quiz_task_id)
+    if existing_result:
+        remove_files(created_files_paths)
+        return existing_result
+
+    client = get_redis()
+    aborted = client.exists(abort_key(quiz_task_id))
+
+    def cleanup():
+        client.delete(progress_key(quiz_task_id), abort_key(quiz_task_id))
+        get_checkpoint(quiz_task_id).clear()
+        remove_files(created_files_paths)
+
+    errors = [r["error"] for r in results if r and "error" in r]
+    if "Incorrect API key provided" in errors:
+        cleanup()
+        return quiz_error_result("Incorrect API key provided", 401)
+
+    if errors:
+        cleanup()
+        print("Error during quiz creation: ", errors[0])
+        raise Exception(errors[0])
+
+    questions = [
+        GeneratedQuestion.parse_obj(r["question"])
+        for r in results
+        if r and "question" in r
+    ]
+
+    # If the question could not generate due to content being too short, we can assume that the
+    # each provided segment is too short, not just this particular segment.
+    if aborted or any(not q.success and "too short" in q.message for q in questions):
+        cleanup()
+        return quiz_error_result(TOO_SHORT_MESSAGE, "too-short")
+
+    questions, response_code, response_message = summarize_questions(questions)
+
+    # If no questions were generated
+    if len(questions) <= 0:
+        cleanup()
+        return quiz_error_result(response_message, response_code)
+
+    quiz, insert_time = save_quiz(
+        quiz_task_id,
+        subject_id,
+        title,
+        success_percentage,
+        description,
+        duration,
+        user_ip,
+        language_code,
+        questions,
+    )
+
+    cleanup()
+    return quiz_created_result(quiz.id, response_message, response_code, insert_time)
+
+
+def get_fair_scheduler() -> FairScheduler:
+    return FairScheduler(get_redis(), ttl=app.config["FAIR_SCHEDULING_TTL"])
+
+
+@before_task_publish.connect
+def record_enqueued_at(headers=None, **extra):
+    # Read by `record_queue_wait`, once a worker starts the task
+    if headers is not None:
+        headers["enqueued_at"] = time.time()
+
+
+@task_prerun.connect
+def record_queue_wait(task_id=None, task=None, **extra):
+    """
+    Records how long the task waited in its queue, for the queues' statistics.
+    """
+    request = task.request
+    enqueued_at = getattr(request, "enqueued_at", None) or (
+        getattr(request, "headers", None) or {}
+    ).get("enqueued_at")
+    lane = (request.delivery_info or {}).get("routing_key")
+    if not enqueued_at or not lane:
+        return
+
+    try:
+        get_fair_scheduler().record_wait(lane, time.time() - float(enqueued_at))
+    except Exception as e:
+        print("Unable to record the queue wait: ", str(e))
+
+
+@task_postrun.connect
+def on_quiz_task_done(task_id=None, task=None, kwargs=None, state=None, **extra):
+    """
+    Once the quiz's task is done, lets the next identical quiz request start a new task and lowers
+    the client's number of active quizzes. Replaced and retried tasks are not done, the quiz's
+    final task has the same ID.
+    """
+    if state not in states.READY_STATES:
+        return
+
+    kwargs = kwargs or {}
+    single_flight_key = kwargs.get("single_flight_key")
+    user_ip = kwargs.get("user_ip")
+
+    try:
+        if single_flight_key:
+            SingleFlight(get_redis(), ttl=app.config["SINGLE_FLIGHT_TTL"]).release(
+                single_flight_key, task_id
+            )
+        if user_ip:
+            get_fair_scheduler().leave(user_ip)
+    except Exception as e:
+        # The lock and the counters expire on their own
+        print("Unable to release the quiz's task: ", str(e))
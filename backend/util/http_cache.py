@@ -0,0 +1,27 @@
+import hashlib
+from typing import Any, Callable
+from flask import Response, jsonify, request
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Returns an ETag of the given parts, e.g. the IDs and versions of the rows of a response.
+    """
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()[:32]
+
+
+def conditional_json(
+    etag: str, cache_control: str, build: Callable[[], Any]
+) -> Response:
+    """
+    Returns an empty 304 response if the client already has the `etag` version, without calling
+    `build`, or the JSON of what `build` returns otherwise.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
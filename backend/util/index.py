@@ -1,8 +1,8 @@
-import os
 from typing import List
 from datetime import datetime
 from sqlalchemy import Column, DateTime, event
 from app import db, app
+from util.storage import get_upload_storage
 
 
 class BaseModel(db.Model):
@@ -47,7 +47,9 @@ def allowed_file(filename: str):
 
 def remove_files(files: List[str]):
     """
-    Remove files from the file system
+    Release uploaded files from the upload storage, their data is only removed once no other
+    upload references it. Files that were already removed are ignored
     """
+    storage = get_upload_storage()
     for file in files:
-        os.remove(file)
+        storage.release(file)
@@ -0,0 +1,57 @@
+import time
+from typing import List, NamedTuple
+from sqlalchemy import insert
+from app import db
+from models import Answer, Question, Quiz
+
+
+class AnswerData(NamedTuple):
+    title: str
+    is_correct: bool
+
+
+class QuestionData(NamedTuple):
+    title: str
+    answers: List[AnswerData]
+
+
+def bulk_insert_questions(quiz_id: int, questions: List[QuestionData]) -> None:
+    """
+    Inserts the questions of the quiz and their answers with one multi row INSERT per table,
+    instead of a statement per row. Does not commit the session.
+    """
+    if not questions:
+        return
+
+    # The IDs are returned in the order of the inserted rows
+    question_ids = db.session.scalars(
+        insert(Question).returning(Question.id, sort_by_parameter_order=True),
+        [{"title": q.title, "quiz_id": quiz_id} for q in questions],
+    ).all()
+
+    answers = [
+        {"title": a.title, "is_correct": a.is_correct, "question_id": question_id}
+        for question_id, q in zip(question_ids, questions)
+        for a in q.answers
+    ]
+    if answers:
+        db.session.execute(insert(Answer), answers)
+
+
+def save_quiz_with_questions(quiz: Quiz, questions: List[QuestionData]) -> float:
+    """
+    Persists the quiz with its questions and answers in a single transaction, and returns the time
+    spent inserting them, in seconds. The session is rolled back if anything fails.
+    """
+    start = time.perf_counter()
+    try:
+        quiz.question_count = len(questions)
+        db.session.add(quiz)
+        # Assigns the quiz's ID
+        db.session.flush()
+        bulk_insert_questions(quiz.id, questions)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return time.perf_counter() - start
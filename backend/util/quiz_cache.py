@@ -0,0 +1,136 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Optional
+import redis
+from app import app
+from util.redis_client import get_redis
+
+# Caches the entry unless the quiz was invalidated in the meantime, so that a request that loaded
+# the quiz before it changed does not cache the old version
+SET_SCRIPT = """
+if redis.call("EXISTS", KEYS[2]) == 0 then
+    return redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+end
+return 0
+"""
+
+
+class QuizCache:
+    """
+    Read-through cache of the serialized quizzes, by ID. The entries are kept in Redis for `ttl`
+    seconds, and in an in-process LRU of `local_max_entries` for `local_ttl` seconds in front of
+    it. Invalidating a quiz clears it from Redis and from this process' LRU, the other processes
+    keep serving their copy until it expires, so `local_ttl` should be short.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        ttl: int,
+        local_ttl: float,
+        local_max_entries: int,
+        invalidation_window: int = 60,
+        # Versioned, so that entries of an older shape are not read after a deploy
+        prefix: str = "quizzes:cache:v2",
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_max_entries = local_max_entries
+        # Seconds after an invalidation during which the quiz is not cached again
+        self.invalidation_window = invalidation_window
+        self.prefix = prefix
+        self.set_script = client.register_script(SET_SCRIPT)
+        # Quiz ID -> (expiry time, entry), the least recently used first
+        self._local: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry_key(self, quiz_id: int) -> str:
+        return f"{self.prefix}:entry:{quiz_id}"
+
+    def _invalidated_key(self, quiz_id: int) -> str:
+        return f"{self.prefix}:invalidated:{quiz_id}"
+
+    def _get_local(self, quiz_id: int) -> Optional[dict]:
+        with self._lock:
+            item = self._local.get(quiz_id)
+            if item is None:
+                return None
+
+            expires_at, entry = item
+            if expires_at < time.monotonic():
+                del self._local[quiz_id]
+                return None
+
+            self._local.move_to_end(quiz_id)
+            return entry
+
+    def _set_local(self, quiz_id: int, entry: dict) -> None:
+        with self._lock:
+            self._local[quiz_id] = (time.monotonic() + self.local_ttl, entry)
+            self._local.move_to_end(quiz_id)
+            while len(self._local) > self.local_max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, quiz_id: int, load: Callable[[], Optional[dict]]) -> Optional[dict]:
+        """
+        Returns the cached entry of the quiz, or loads it with `load` and caches it. Returns None,
+        without caching anything, if `load` does not find the quiz. The entry is shared, it must
+        not be modified. While Redis is unavailable, the quiz is loaded with `load` every time.
+        """
+        entry = self._get_local(quiz_id)
+        if entry is not None:
+            return entry
+
+        try:
+            value = self.client.get(self._entry_key(quiz_id))
+        except redis.RedisError as e:
+            print("Unable to read the quiz cache: ", str(e))
+            return load()
+
+        if value is not None:
+            entry = json.loads(value)
+        else:
+            entry = load()
+            if entry is None:
+                return None
+
+            try:
+                self.set_script(
+                    keys=[self._entry_key(quiz_id), self._invalidated_key(quiz_id)],
+                    args=[json.dumps(entry), self.ttl],
+                )
+            except redis.RedisError as e:
+                print("Unable to write the quiz cache: ", str(e))
+                return entry
+
+        self._set_local(quiz_id, entry)
+        return entry
+
+    def invalidate(self, quiz_id: int) -> None:
+        """
+        Clears the cached entry of the quiz, once it changed or was deleted.
+        """
+        with self._lock:
+            self._local.pop(quiz_id, None)
+
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.delete(self._entry_key(quiz_id))
+        pipeline.set(self._invalidated_key(quiz_id), 1, ex=self.invalidation_window)
+        pipeline.execute()
+
+
+@lru_cache(maxsize=None)
+def get_quiz_cache() -> QuizCache:
+    """
+    Returns the quiz cache of the process, so that its in-process LRU is shared by the requests.
+    """
+    return QuizCache(
+        get_redis(),
+        ttl=app.config["QUIZ_CACHE_TTL"],
+        local_ttl=app.config["QUIZ_CACHE_LOCAL_TTL"],
+        local_max_entries=app.config["QUIZ_CACHE_LOCAL_MAX_ENTRIES"],
+    )
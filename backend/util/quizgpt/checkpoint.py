@@ -0,0 +1,41 @@
+import hashlib
+from typing import Optional
+import redis
+
+
+class GenerationCheckpoint:
+    """
+    Questions already generated by a task, stored in a Redis hash keyed by segment, so that a
+    retried or redelivered task resumes where it stopped instead of generating them again.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        task_id: str,
+        ttl: int,
+        prefix: str = "quizgpt:checkpoint",
+    ) -> None:
+        self.client = client
+        self.key = f"{prefix}:{task_id}"
+        self.ttl = ttl
+
+    @staticmethod
+    def _field(segment: str) -> str:
+        return hashlib.sha256(segment.encode()).hexdigest()
+
+    def get(self, segment: str) -> Optional[str]:
+        """
+        Returns the question generated earlier for the segment, or None.
+        """
+        value = self.client.hget(self.key, self._field(segment))
+        return value.decode() if value is not None else None
+
+    def set(self, segment: str, value: str) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.hset(self.key, self._field(segment), value)
+        pipeline.expire(self.key, self.ttl)
+        pipeline.execute()
+
+    def clear(self) -> None:
+        self.client.delete(self.key)
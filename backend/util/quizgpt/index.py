@@ -1,9 +1,29 @@
+import os
 import re
-import json
-from typing import List, Literal
-import openai
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    TypeVar,
+)
+import billiard
+from langchain_core.document_loaders import BaseLoader
 from langchain_core.documents import Document
-from langchain_openai import ChatOpenAI
+from langchain_core.exceptions import OutputParserException
 from langchain_community.document_loaders import (
     PyPDFLoader,
     UnstructuredMarkdownLoader,
@@ -11,20 +31,157 @@ from langchain_community.document_loaders import (
     UnstructuredWordDocumentLoader,
 )
 from langchain_core.pydantic_v1 import BaseModel, Field
+from langdetect import DetectorFactory, detect_langs
+from langdetect.lang_detect_exception import LangDetectException
 from util.index import get_file_extension
+from util.quizgpt.checkpoint import GenerationCheckpoint
+from util.quizgpt.languages import get_language_registry
+from util.quizgpt.parse_cache import ParseCache, count_pages, iter_pages, write_pages
+from util.quizgpt.providers import LLMProvider, get_openai_provider
+from util.quizgpt.rate_limiter import OpenAIRateLimiter
+from util.quizgpt.response_cache import ResponseCache
+from util.quizgpt.segmenter import Segmenter
+
+T = TypeVar("T")
+
+# Make langdetect's results deterministic across runs
+DetectorFactory.seed = 0
+
+# Model used to generate the questions
+QUESTION_MODEL = "gpt-4o"
+# Bump whenever the question prompts change, so that cached responses of older prompts are not reused
+QUESTION_PROMPT_VERSION = "1"
+# Model used to detect the language of the documents the offline detection is unsure about
+LANGUAGE_MODEL = "gpt-3.5-turbo-0125"
+# Tokens reserved for the completion of each generated question, when pacing the requests
+COMPLETION_TOKENS_PER_QUESTION = 300
+
+
+# Pages longer than this are split, so that a single page never has to be held in memory whole.
+# Some loaders return the whole file as a single page (e.g. text files).
+MAX_PAGE_LENGTH = 20_000
+
+
+def split_long_pages(pages: Iterable[Document]) -> Iterator[Document]:
+    """
+    Lazily splits pages longer than `MAX_PAGE_LENGTH` characters, preferably on paragraph breaks.
+    """
+    for page in pages:
+        content = page.page_content
+        while len(content) > MAX_PAGE_LENGTH:
+            cut = content.rfind("\n\n", 0, MAX_PAGE_LENGTH)
+            if cut <= 0:
+                cut = content.rfind(" ", 0, MAX_PAGE_LENGTH)
+            if cut <= 0:
+                cut = MAX_PAGE_LENGTH
+            yield Document(page_content=content[:cut], metadata=page.metadata)
+            content = content[cut:]
+        yield Document(page_content=content, metadata=page.metadata)
+
+
+class FileParsingError(Exception):
+    """
+    Raised when some of the provided files could not be parsed.
+    """
+
+    def __init__(self, errors: Dict[str, Exception]) -> None:
+        self.errors = errors
+        super().__init__(
+            "Unable to parse the provided files: "
+            + ", ".join(
+                f"{os.path.basename(file)} ({error})" for file, error in errors.items()
+            )
+        )
+
+
+def get_loader(file: str) -> BaseLoader:
+    """
+    Returns the document loader of the file, based on its extension.
+    """
+    file_extension = get_file_extension(file)
+
+    if file_extension in ["md", "markdown"]:
+        return UnstructuredMarkdownLoader(file)
+    elif file_extension in ["pdf"]:
+        return PyPDFLoader(file)
+    elif file_extension in ["txt"]:
+        return TextLoader(file)
+    elif file_extension in ["docx", "doc"]:
+        return UnstructuredWordDocumentLoader(file)
+
+    raise ValueError(f"Unsupported file extension: {file_extension}")
 
 
-def trim_segment(segment: str) -> str:
+def parse_file(file: str, output_path: str, parse_cache: Optional[ParseCache]) -> str:
     """
-    Trims the segment to the maximum token length.
+    Parses the file into pages, in the `write_pages` format, reusing the pages of an identical
+    file parsed earlier if the parse cache is enabled. Safe to run in a separate process.
+
+    Returns the path of the parsed pages: the parse cache entry, or `output_path` if the parse
+    cache is disabled.
+    """
+    loader = get_loader(file)
+
+    if not parse_cache:
+        with open(output_path, "wb") as f:
+            write_pages(f, split_long_pages(loader.lazy_load()))
+        return output_path
+
+    key = parse_cache.key(file, type(loader).__name__)
+    page_file = parse_cache.open(key)
+    if page_file is None:
+        page_file = parse_cache.put(key, split_long_pages(loader.lazy_load()))
+    page_file.close()
+
+    return page_file.name
+
+
+# Semaphores shared by every QuizGPT instance in this process, so that concurrent quizzes
+# using the same API key do not multiply the number of in-flight requests. The limit is per
+# process: each Celery worker process has its own semaphores. They are keyed by a hash of the
+# API key, never the key itself, and dropped once no quiz uses them.
+_api_key_semaphores: "weakref.WeakValueDictionary[str, threading.BoundedSemaphore]" = (
+    weakref.WeakValueDictionary()
+)
+_api_key_semaphores_lock = threading.Lock()
+
+
+def get_api_key_semaphore(api_key: str, limit: int) -> threading.BoundedSemaphore:
     """
-    # It doesnt matter the exact max tokens, we just want to make sure the segment is not too long.
-    # We should probably consider using a tokenizer in the future
-    max_tokens = 6000
-    segment = segment.strip()
-    if len(segment) > max_tokens:
-        segment = segment[:max_tokens]
-    return segment
+    Returns the process wide semaphore that bounds the concurrent requests made with `api_key`.
+    It is created with the `limit` of its first caller, there is a single semaphore per key.
+    The caller must keep a reference to it while making requests.
+    """
+    key = hashlib.sha256(api_key.encode()).hexdigest()
+    with _api_key_semaphores_lock:
+        semaphore = _api_key_semaphores.get(key)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(limit)
+            _api_key_semaphores[key] = semaphore
+        return semaphore
+
+
+def detect_language_offline(text: str) -> tuple[Optional[str], float]:
+    """
+    Detects the language of the text locally, using langdetect's bundled character n-gram profiles.
+
+    Returns the language name from `languages.json` and the detection's confidence (between 0
+    and 1), or (None, 0.0) if the language could not be detected.
+    """
+    try:
+        candidates = detect_langs(text)
+    except LangDetectException:
+        return None, 0.0
+
+    if not candidates:
+        return None, 0.0
+
+    best = candidates[0]
+    language = get_language_registry().get_by_code(best.lang)
+    if not language:
+        return None, 0.0
+
+    return language.name, best.prob
 
 
 class Answer(BaseModel):
@@ -43,34 +200,203 @@ class Question(BaseModel):
     message: str = Field(description="An additional response message")
 
 
+class ExamQuestion(Question):
+    segment: int = Field(
+        description="The number of the text segment the question was generated from"
+    )
+
+
 class Exam(BaseModel):
-    questions: List[Question] = Field(description="List of exam questions")
+    questions: List[ExamQuestion] = Field(description="List of exam questions")
     language: str = Field(description="The language of the provided text")
 
 
+TOO_SHORT_MESSAGE = "The provided content is too short to generate questions."
+
+
+def summarize_questions(
+    questions: List[Question],
+) -> tuple[List[Question], Literal["success", "too-short", "irrelevant", "vague"], str]:
+    """
+    Filters out the unsuccessful questions, and describes why they could not be generated.
+
+    Returns the successful questions, a status code message and a human readable message.
+    """
+    status_code_message: str = ""
+    message: str = ""
+
+    failed_questions_count = len([q for q in questions if not q.success or not q.title])
+    if failed_questions_count > 0:
+        message = f"{failed_questions_count} questions could not be generated."
+        for q in questions:
+            if not q.success:
+                if "too short" in q.message:
+                    status_code_message = "too-short"
+                    message += " The content is too short to generate a question."
+                elif "irrelevant" in q.message:
+                    status_code_message = "irrelevant"
+                    message += " The content is irrelevant to generate a question."
+                elif "vague" in q.message:
+                    status_code_message = "vague"
+                    message += " The content is too vague to generate a question."
+    else:
+        status_code_message = "success"
+        message = "All questions were successfully generated."
+
+    # Filter out any questions that were not successful
+    questions = [q for q in questions if q.success and q.title]
+
+    return questions, status_code_message, message
+
+
 class QuizGPT:
-    def __init__(self, openai_api_key: str, celery_task, files: List[str]) -> None:
-        pages = []
-        for file in files:
-            file_extension = get_file_extension(file)
-
-            if file_extension in ["md", "markdown"]:
-                loader = UnstructuredMarkdownLoader(file)
-            elif file_extension in ["pdf"]:
-                loader = PyPDFLoader(file)
-            elif file_extension in ["txt"]:
-                loader = TextLoader(file)
-            elif file_extension in ["docx", "doc"]:
-                loader = UnstructuredWordDocumentLoader(file)
-
-            documents = loader.load_and_split()
-            pages.extend(documents)
-
-        self.pages = pages
+    def __init__(
+        self,
+        openai_api_key: str,
+        celery_task,
+        files: List[str],
+        max_concurrency: int = 1,
+        batch_size: int = 1,
+        language_detection_threshold: float = 0.9,
+        parse_cache: Optional[ParseCache] = None,
+        response_cache: Optional[ResponseCache] = None,
+        max_segment_tokens: int = 1500,
+        parse_workers: int = 1,
+        checkpoint: Optional[GenerationCheckpoint] = None,
+        language: Optional[str] = None,
+        rate_limiter: Optional[OpenAIRateLimiter] = None,
+        provider: Optional[LLMProvider] = None,
+    ) -> None:
+        self.parse_cache = parse_cache
+        # Paces the GPT calls across workers and retries the transient errors, instead of the clients
+        self.rate_limiter = rate_limiter
+        self.provider = provider or get_openai_provider(
+            openai_api_key, rate_limited=rate_limiter is not None
+        )
+        self.response_cache = response_cache
+        self.checkpoint = checkpoint
+
+        # Seconds spent in each stage, and its peak memory in bytes when tracemalloc is tracing
+        self.timings: Dict[str, float] = {}
+        self.peak_memory: Dict[str, int] = {}
+
+        # The parsed pages of every file, in `write_pages` format, read lazily whenever needed
+        self.page_files: List[BinaryIO] = []
+        self.page_count = 0
+        with self._timed("load"):
+            self._load_files(files, parse_workers)
+
         self.openai_api_key = openai_api_key
         self.celery_task = celery_task
-        self.language = self._detect_document_language()
-        self.language = self._validate_language_or_default(self.language, "unknown")
+        # Maximum number of questions generated at the same time with this API key
+        self.max_concurrency = max(1, max_concurrency)
+        # Number of segments packed into a single GPT call, 1 disables batching
+        self.batch_size = max(1, batch_size)
+        # Minimum confidence of the offline language detection before falling back to GPT
+        self.language_detection_threshold = language_detection_threshold
+        self.segmenter = Segmenter(QUESTION_MODEL, max_segment_tokens)
+        # The language can be provided when it was already detected, e.g. by a planning task
+        with self._timed("language_detection"):
+            self.language = language or self._detect_document_language()
+            self.language = self._validate_language_or_default(self.language, "unknown")
+
+    @contextmanager
+    def _timed(self, stage: str) -> Iterator[None]:
+        """
+        Adds the time spent in the block to the stage's timing. Its peak memory is recorded too when
+        tracemalloc is tracing, e.g. by the benchmark.
+        """
+        track_memory = tracemalloc.is_tracing()
+        if track_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = (
+                self.timings.get(stage, 0.0) + time.perf_counter() - start
+            )
+            if track_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.peak_memory[stage] = max(self.peak_memory.get(stage, 0), peak)
+
+    def _load_files(self, files: List[str], parse_workers: int) -> None:
+        """
+        Parses the files, up to `parse_workers` files at a time in separate processes, and opens
+        their pages in the order of `files`.
+
+        Raises `FileParsingError` with the error of every file that could not be parsed.
+        """
+        spool_directory = tempfile.mkdtemp(prefix="quizgpt-")
+        try:
+            spool_paths = [
+                os.path.join(spool_directory, f"{i}.jsonl.gz")
+                for i in range(len(files))
+            ]
+            paths: List[Optional[str]] = [None] * len(files)
+            errors: Dict[str, Exception] = {}
+
+            if parse_workers > 1 and len(files) > 1:
+                # Billiard's processes, unlike multiprocessing's, may start children, so that
+                # Celery's daemonic prefork workers parse the files in parallel too. Spawned, since
+                # forking a process that runs threads can deadlock the children.
+                pool = billiard.get_context("spawn").Pool(
+                    processes=min(parse_workers, len(files))
+                )
+                try:
+                    results = [
+                        pool.apply_async(
+                            parse_file, (file, spool_path, self.parse_cache)
+                        )
+                        for file, spool_path in zip(files, spool_paths)
+                    ]
+                    for i, result in enumerate(results):
+                        try:
+                            paths[i] = result.get()
+                        except Exception as e:
+                            errors[files[i]] = e
+                finally:
+                    pool.terminate()
+                    pool.join()
+            else:
+                for i, file in enumerate(files):
+                    try:
+                        paths[i] = parse_file(file, spool_paths[i], self.parse_cache)
+                    except Exception as e:
+                        errors[files[i]] = e
+
+            if errors:
+                raise FileParsingError(errors)
+
+            for file, spool_path, path in zip(files, spool_paths, paths):
+                try:
+                    page_file = open(path, "rb")
+                except FileNotFoundError:
+                    # Evicted from the parse cache in the meantime
+                    page_file = open(parse_file(file, spool_path, None), "rb")
+                self.page_files.append(page_file)
+                self.page_count += count_pages(page_file)
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            # The opened page files stay readable until they are closed
+            shutil.rmtree(spool_directory, ignore_errors=True)
+
+    def _iter_pages(self) -> Iterator[str]:
+        """
+        Lazily yields the content of every page, one page at a time.
+        """
+        for page_file in self.page_files:
+            for page in iter_pages(page_file):
+                yield page.page_content
+
+    def close(self) -> None:
+        """
+        Closes the files of the parsed pages. Temporary ones are deleted once closed.
+        """
+        for page_file in self.page_files:
+            page_file.close()
 
     def _clean_text(self, text: str) -> str:
         """
@@ -85,97 +411,89 @@ class QuizGPT:
 
         return text
 
-    def _detect_document_language(self) -> str:
+    def _sample_document_text(
+        self, max_samples: int = 8, sample_length: int = 1000
+    ) -> str:
         """
-        Detect language of document using GPT.
-        Could use another method to detect language, but this will do for now.
-        """
-        total_pages = len(self.pages)
-
-        # Function to find the middle index and adjust
-        def find_middle_index(current_page: int) -> int:
-            return total_pages // 2 if current_page is None else current_page + 1
-
-        current_page = None
-
-        # Starting from the middle page (no particular reason for starting from there), loop
-        # through the pages to detect the language
-        while True:
-            ### Issue with some materials where the language detection is not working, starting from the first page.
-            # current_page = find_middle_index(current_page)
-            current_page = 0 if current_page is None else current_page + 1
-
-            # If we've reached the end of the pages, it means we couldn't detect the language
-            if current_page >= total_pages:
-                return "unknown"
-
-            text = self.pages[current_page].page_content
-            text = self._clean_text(text)
-            # Prepare a prompt for GPT to detect the language of the content
-            prompt = f"What language is the following text written in? If you do not know, respond with lower case 'unknown'.\n{text}"
-            # Call the GPT API to detect the language
-            client = openai.OpenAI(api_key=self.openai_api_key)
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=[{"role": "user", "content": prompt}],
-            )
-            # Return the detected language text
-            detected_language = response.choices[0].message.content.lower()
-
-            # Assuming GPT will return 'unknown' if it can't detect the language
-            if detected_language.lower() not in ["unknown"]:
-                return detected_language
-
-            # If the detected language is unknown or empty, move to the next page
-            current_page += 1
+        Samples cleaned text from pages spread evenly across the document, so that a cover page or
+        front matter in another language does not decide the document's language on its own.
+        """
+        if self.page_count <= max_samples:
+            indices = set(range(self.page_count))
+        else:
+            # The first and last pages, and evenly spaced pages in between
+            last = self.page_count - 1
+            indices = {
+                round(i * last / max(1, max_samples - 1)) for i in range(max_samples)
+            }
+
+        last_index = max(indices, default=-1)
+        samples = []
+        for i, page in enumerate(self._iter_pages()):
+            if i > last_index:
+                break
+            if i not in indices:
+                continue
+            text = self._clean_text(page).strip()
+            if text:
+                samples.append(text[:sample_length])
+
+        return "\n".join(samples)
 
-    def _validate_language_or_default(self, value: str, default: str) -> str:
+    def _detect_document_language(self) -> str:
         """
-        Validates the language provided, whether it is a real language or not. If
-        not, returns the provided `default` value.
+        Detect language of document locally, using a sample of text from across the document.
+        GPT is only used when the local detection is not confident enough.
         """
-        with open("util/quizgpt/languages.json") as f:
-            d = json.load(f)
-            languages: List[str] = [l["name"].lower() for l in d]
+        text = self._sample_document_text()
+
+        # Nothing to detect, e.g. a scanned document without a text layer
+        if not text:
+            return "unknown"
 
-            if value.lower() in languages:
-                return value
+        language, confidence = detect_language_offline(text)
+        if language and confidence >= self.language_detection_threshold:
+            return language
 
-            return default
+        return self._gpt_detect_language(text)
 
-    def _extract_content(self, pages: List[Document]) -> str:
+    def _gpt_detect_language(self, text: str) -> str:
         """
-        Extracts the text content from the provided pages and combines them into a single string variable.
+        Detect language of the text using GPT.
         """
-        combined_text = " ".join(pages.page_content for pages in pages)
-        return self._clean_text(combined_text)
-
-    def _split_content(self, content, num_segments) -> List[str]:
+        # Prepare a prompt for GPT to detect the language of the content
+        prompt = f"What language is the following text written in? If you do not know, respond with lower case 'unknown'.\n{text}"
+        # Call the GPT API to detect the language
+        response = self._call_gpt(
+            LANGUAGE_MODEL,
+            self.segmenter.count_tokens(prompt) + 10,
+            lambda: self.provider.completion(LANGUAGE_MODEL, prompt),
+        )
+        # Assuming GPT will return 'unknown' if it can't detect the language
+        return response.lower()
+
+    def _call_gpt(self, model: str, tokens: int, request: Callable[[], T]) -> T:
         """
-        Splits content into approximately equal segments and returns them
+        Makes a GPT request of about `tokens` tokens, through the rate limiter if there is one.
         """
-        # Split content into approximately equal segments
-        segment_length = len(content) // num_segments
-        segments = [
-            content[i * segment_length : (i + 1) * segment_length]
-            for i in range(num_segments)
-        ]
-        # Handle any remaining content by adding it to the last segment
-        if len(content) % num_segments != 0:
-            segments[-1] += content[num_segments * segment_length :]
-        return segments
+        if not self.rate_limiter:
+            return request()
+        return self.rate_limiter.call(self.openai_api_key, model, tokens, request)
 
-    def _gpt_generate_question(self, content: str) -> Question:
+    def _validate_language_or_default(self, value: str, default: str) -> str:
         """
-        Generates a question based on the provided content using GPT
+        Validates the language provided, whether it is a real language or not. Returns the
+        language's name as listed in `languages.json`, or the provided `default` value if the
+        language is unknown.
         """
-        llm = ChatOpenAI(model="gpt-4o", api_key=self.openai_api_key)
-
-        # structured_llm = llm.with_structured_output(Exam)
-        structured_llm = llm.with_structured_output(Question)
+        language = get_language_registry().resolve(value)
+        return language.name if language else default
 
-        PROMPT = f"""
-        Based on the below exam material text, generate a single exam question. Apply the following rules:
+    def _question_rules(self) -> str:
+        """
+        Returns the rules every generated question must follow, shared by the single and batched prompts.
+        """
+        return f"""
         - {f"The question's language must be {self.language}." if self.language else "Detect the question's language based on the material text."}
         - Create exactly 4 answers for the question.
         - The generated question must be meaningful and relevant to the provided content.
@@ -186,14 +504,255 @@ class QuizGPT:
         - - If the content is irrelevant, use the exact message: "The content is irrelevant to generate a question."
         - - If the content is too vague, use the exact message: "The content is too vague to generate a question."
         - - If none of the above apply, use the exact message: "The question could not be generated." + additional text that provides a reason as to why the question could not be generated.
+        """
+
+    def _gpt_generate_question(self, content: str) -> Question:
+        """
+        Generates a question based on the provided content using GPT
+        """
+        PROMPT = f"""
+        Based on the below exam material text, generate a single exam question. Apply the following rules:
+        {self._question_rules()}
 
         Text:
         {content}
         """
 
-        result = structured_llm.invoke(PROMPT)
+        result = self._call_gpt(
+            QUESTION_MODEL,
+            self.segmenter.count_tokens(PROMPT) + COMPLETION_TOKENS_PER_QUESTION,
+            lambda: self.provider.structured_completion(
+                QUESTION_MODEL, Question, PROMPT
+            ),
+        )
         return result
 
+    def _gpt_generate_questions_batch(self, segments: List[str]) -> List[Question]:
+        """
+        Generates one question per segment with a single GPT call, using the `Exam` schema.
+
+        The returned questions are in the order of the provided segments. Segments that GPT skipped, or
+        whose response could not be parsed, are returned as unsuccessful questions so they are retried
+        one by one.
+        """
+        texts = "\n".join(f"""
+        Segment {i + 1}:
+        {segment}
+        """ for i, segment in enumerate(segments))
+
+        PROMPT = f"""
+        Below are {len(segments)} numbered segments of exam material text. Generate exactly one exam question for each segment, based only on that segment's text, and set the question's `segment` field to the segment's number. Apply the following rules to every question:
+        {self._question_rules()}
+
+        {texts}
+        """
+
+        questions: List[Optional[Question]] = [None] * len(segments)
+        try:
+            exam: Optional[Exam] = self._call_gpt(
+                QUESTION_MODEL,
+                self.segmenter.count_tokens(PROMPT)
+                + COMPLETION_TOKENS_PER_QUESTION * len(segments),
+                lambda: self.provider.structured_completion(
+                    QUESTION_MODEL, Exam, PROMPT
+                ),
+            )
+        except (OutputParserException, ValueError) as e:
+            # Pydantic v1's ValidationError is a ValueError
+            print("Unable to parse batched questions: ", str(e))
+            exam = None
+
+        if exam is None:
+            exam = Exam(questions=[], language=self.language or "unknown")
+
+        for question in exam.questions:
+            index = question.segment - 1
+            if 0 <= index < len(segments) and questions[index] is None:
+                questions[index] = question
+
+        return [
+            question
+            or Question(
+                title="",
+                answers=[],
+                language=exam.language,
+                success=False,
+                message="The question could not be generated. It was missing from the batched response.",
+            )
+            for question in questions
+        ]
+
+    def _response_cache_key(self, segment: str) -> str:
+        return ResponseCache.key(
+            segment, self.language or "", QUESTION_MODEL, QUESTION_PROMPT_VERSION
+        )
+
+    def _get_cached_question(self, segment: str) -> Optional[Question]:
+        """
+        Returns the question generated earlier for the segment, by this task (before it was
+        interrupted), or by any task for the same segment, language, model and prompt.
+        """
+        if self.checkpoint:
+            checkpointed = self.checkpoint.get(segment)
+            if checkpointed:
+                return Question.parse_raw(checkpointed)
+
+        if not self.response_cache:
+            return None
+
+        cached = self.response_cache.get(self._response_cache_key(segment))
+        return Question.parse_raw(cached) if cached else None
+
+    def _cache_question(self, segment: str, question: Question) -> None:
+        """
+        Checkpoints and caches the question of the segment. Only successfully generated questions
+        are kept, failed ones are generated again.
+        """
+        if not question.success or not question.title:
+            return
+
+        if self.checkpoint:
+            self.checkpoint.set(segment, question.json())
+
+        if self.response_cache:
+            self.response_cache.set(self._response_cache_key(segment), question.json())
+
+    def _generate_segments_questions(
+        self,
+        segments: List[str],
+        abort_on_too_short: bool = False,
+        on_question_generated: Optional[Callable[[int], None]] = None,
+        batch_size: Optional[int] = None,
+    ) -> Optional[List[Question]]:
+        """
+        Generates a question for every segment, running up to `max_concurrency` GPT calls at a time.
+        Each call covers up to `batch_size` segments (defaults to the instance's `batch_size`).
+        Segments with a checkpointed or cached question are not sent to GPT.
+
+        The returned questions keep the order of the provided segments. `on_question_generated` is
+        called with the number of completed segments every time a call finishes. If
+        `abort_on_too_short` is set and GPT reports that a segment is too short, pending calls are
+        cancelled and None is returned.
+        """
+        if not segments:
+            return []
+
+        batch_size = batch_size or self.batch_size
+        semaphore = get_api_key_semaphore(self.openai_api_key, self.max_concurrency)
+
+        def generate(batch: List[str]) -> List[Question]:
+            with semaphore:
+                if len(batch) == 1:
+                    return [self._gpt_generate_question(batch[0])]
+                return self._gpt_generate_questions_batch(batch)
+
+        questions: List[Optional[Question]] = [
+            self._get_cached_question(segment) for segment in segments
+        ]
+        pending = [i for i, question in enumerate(questions) if question is None]
+
+        completed = len(segments) - len(pending)
+        if completed and on_question_generated:
+            on_question_generated(completed)
+
+        if not pending:
+            return questions
+
+        batches = [
+            pending[start : start + batch_size]
+            for start in range(0, len(pending), batch_size)
+        ]
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(batches))
+        )
+        try:
+            futures = {
+                executor.submit(generate, [segments[i] for i in batch]): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                for i, question in zip(batch, future.result()):
+                    if (
+                        abort_on_too_short
+                        and not question.success
+                        and "too short" in question.message
+                    ):
+                        return None
+
+                    questions[i] = question
+                    self._cache_question(segments[i], question)
+
+                completed += len(batch)
+                if on_question_generated:
+                    on_question_generated(completed)
+        finally:
+            # Drop the calls that did not start yet, in case we returned or raised early
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        return questions
+
+    def estimate_prompt_tokens(self, segments: List[str]) -> int:
+        """
+        Estimates the number of prompt tokens needed to generate a question for every segment,
+        without the cached segments and the retries of failed questions.
+        """
+        num_calls = -(-len(segments) // self.batch_size)
+        return self.segmenter.estimate_tokens(segments) + num_calls * (
+            self.segmenter.count_tokens(self._question_rules())
+        )
+
+    def plan_segments(self, num_questions: int) -> Optional[List[str]]:
+        """
+        Splits the provided pages into a segment for every question, and reports the estimated
+        prompt tokens as the task's initial progress.
+
+        Returns None if the content is too short for the number of questions.
+        """
+        if type(num_questions) is not int or num_questions < 1:
+            raise ValueError(
+                "The number of questions must be an integer greater than 0."
+            )
+
+        with self._timed("segmenting"):
+            segments = self.segmenter.segment(self._iter_pages, num_questions)
+
+        # There is not even a sentence for every question
+        if any(not segment for segment in segments):
+            return None
+
+        estimated_tokens = self.estimate_prompt_tokens(segments)
+        print("Estimated prompt tokens: ", estimated_tokens)
+        self.celery_task.update_state(
+            state="PROGRESS",
+            meta={
+                "current": 0,
+                "total": num_questions,
+                "estimated_prompt_tokens": estimated_tokens,
+            },
+        )
+
+        return segments
+
+    def generate_segment_question(self, segment: str) -> Question:
+        """
+        Generates the question of a single segment, retrying once if it is unsuccessful (unless the
+        segment is too short).
+        """
+        with self._timed("generation"):
+            question = self._generate_segments_questions([segment], batch_size=1)[0]
+            if question.success and question.title:
+                return question
+
+            if "too short" in question.message:
+                return question
+
+            new_question = self._generate_segments_questions([segment], batch_size=1)[0]
+            if new_question.success and new_question.title:
+                return new_question
+
+            return question
+
     def generate_questions(
         self, num_questions: int
     ) -> tuple[
@@ -207,104 +766,55 @@ class QuizGPT:
         - A status code message providing additional information about the success/failure of the operation
         - A human readable message providing additional information about the success/failure of the operation
         """
-        if type(num_questions) is not int or num_questions < 1:
-            raise ValueError(
-                "The number of questions must be an integer greater than 0."
-            )
-
-        total_pages = len(self.pages)
-
-        segments = []
-
-        # Return values
-        questions: List[Question] = []
-        status_code_message: str = ""
-        message: str = ""
-
-        # If there are more questions than pages, we'll need to split the content into more segments
-        if num_questions > total_pages:
-            content = self._extract_content(self.pages)
-            segments = self._split_content(content, num_questions)
-        else:
-            segments = []
-            ratio = total_pages / num_questions
-            for i in range(num_questions):
-                start_page = int(i * ratio)
-                end_page = int((i + 1) * ratio) if ratio > 1 else start_page + 1
-                end_page = min(end_page, total_pages)
-                segment_content = self._extract_content(self.pages[start_page:end_page])
-                segments.append(segment_content)
+        segments = self.plan_segments(num_questions)
+        if segments is None:
+            return [], "too-short", TOO_SHORT_MESSAGE
 
         # Generate questions for each segment
-        for i, segment in enumerate(segments):
-            # This is a hotfix to ensure that the segment is not huge, as it can cause GPT to fail and can be a bit expensive.
-            segment = trim_segment(segment)
-            question = self._gpt_generate_question(segment)
-            if not question.success:
-                # If the question could not generate due to content being too short, we can assume that the
-                # each provided segment is too short, not just this particular segment. Meaning that
-                # the user is asking for too much questions for their provided content.
-                #
-                # We do not want to proceed with this, because even though other questions might succeed,
-                # there is a probability that the short content of the question will affect its quality. ##
-                if "too short" in question.message:
-                    return (
-                        [],
-                        "too-short",
-                        "The provided content is too short to generate questions.",
-                    )
-
-            questions.append(question)
+        def on_question_generated(completed: int) -> None:
             self.celery_task.update_state(
-                state="PROGRESS", meta={"current": i + 1, "total": num_questions}
+                state="PROGRESS", meta={"current": completed, "total": num_questions}
+            )
+
+        with self._timed("generation"):
+            generated = self._generate_segments_questions(
+                segments,
+                abort_on_too_short=True,
+                on_question_generated=on_question_generated,
             )
+        # If the question could not generate due to content being too short, we can assume that the
+        # each provided segment is too short, not just this particular segment. Meaning that
+        # the user is asking for too much questions for their provided content.
+        #
+        # We do not want to proceed with this, because even though other questions might succeed,
+        # there is a probability that the short content of the question will affect its quality. ##
+        if generated is None:
+            return [], "too-short", TOO_SHORT_MESSAGE
+        questions = generated
 
-        failed_questions_count = 0
         # In case there are any unsuccessful questions, attempt to regenerate them
-        for i, question in enumerate(questions):
-            # Find the unsuccessful question
-            if not question.success or not question.title:
-                unsuccessful_question_segment = segments[i]
-                new_question = self._gpt_generate_question(
-                    unsuccessful_question_segment
-                )
-                # If the new generated question was still unsuccessful, we can assume GPT is simply unable
-                # to generate the question from the provided segment.
-                if not new_question.success or not new_question.title:
-                    failed_questions_count += 1
-                    # Skip this question.
-                    continue
-
-                # Otherwise we replace the unsuccessful question with the new one.
-                questions[i] = new_question
-
-        if failed_questions_count > 0:
-            message = f"{failed_questions_count} questions could not be generated."
-            for q in questions:
-                if not q.success:
-                    if "too short" in q.message:
-                        status_code_message = "too-short"
-                        message += " The content is too short to generate a question."
-                    elif "irrelevant" in q.message:
-                        status_code_message = "irrelevant"
-                        message += " The content is irrelevant to generate a question."
-                    elif "vague" in q.message:
-                        status_code_message = "vague"
-                        message += " The content is too vague to generate a question."
-        else:
-            status_code_message = "success"
-            message = "All questions were successfully generated."
+        failed_indexes = [
+            i for i, q in enumerate(questions) if not q.success or not q.title
+        ]
+        with self._timed("generation"):
+            regenerated = self._generate_segments_questions(
+                [segments[i] for i in failed_indexes], batch_size=1
+            )
+        for i, new_question in zip(failed_indexes, regenerated):
+            # If the new generated question was still unsuccessful, we can assume GPT is simply unable
+            # to generate the question from the provided segment.
+            if not new_question.success or not new_question.title:
+                # Skip this question.
+                continue
 
-        # Filter out any questions that were not successful
-        questions = [q for q in questions if q.success and q.title]
+            # Otherwise we replace the unsuccessful question with the new one.
+            questions[i] = new_question
 
-        return questions, status_code_message, message
+        return summarize_questions(questions)
 
     def get_language(self) -> tuple[str, str]:
-        with open("util/quizgpt/languages.json") as f:
-            d = json.load(f)
-            for l in d:
-                if l["name"].lower() == self.language:
-                    return l["code"], l["name"]
+        language = get_language_registry().get_by_name(self.language)
+        if language:
+            return language.code, language.name
 
         return "unknown", "unknown"
@@ -0,0 +1,119 @@
+import os
+import re
+import json
+import difflib
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional
+
+LANGUAGES_FILE = os.path.join(os.path.dirname(__file__), "languages.json")
+
+# Common names that LLMs answer with, which are not listed in `languages.json`
+EXTRA_ALIASES = {
+    "greek": "el",
+    "modern greek": "el",
+    "farsi": "fa",
+    "mandarin": "zh",
+    "cantonese": "zh",
+    "filipino": "tl",
+    "scottish gaelic": "gd",
+    "flemish": "nl",
+    "moldovan": "ro",
+}
+
+
+class Language(NamedTuple):
+    code: str
+    name: str
+
+
+def normalize_language(value: str) -> str:
+    """
+    Normalizes a language name for lookups, e.g. " English (US)." -> "english".
+    """
+    value = unicodedata.normalize("NFKD", value.lower())
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    # Drop qualifiers such as regions or dates, e.g. "English (US)" or "Occitan (post 1500)"
+    value = re.sub(r"\(.*?\)", " ", value)
+    value = re.sub(r"[^\w\s]", " ", value)
+    return " ".join(value.split())
+
+
+class LanguageRegistry:
+    """
+    Index of the languages in `languages.json`, looked up by code, name or alias.
+    """
+
+    def __init__(self, languages: List[Language]) -> None:
+        self.languages = languages
+        self._by_code: Dict[str, Language] = {l.code: l for l in languages}
+        self._by_alias: Dict[str, Language] = {}
+
+        # Full names first, so that they win over the aliases of other languages
+        for l in languages:
+            self._by_alias.setdefault(normalize_language(l.name), l)
+
+        for l in languages:
+            for alias in l.name.split(";"):
+                # "Ndebele, North" is also known as "North Ndebele"
+                parts = [p.strip() for p in alias.split(",")]
+                for a in [alias, " ".join(reversed(parts))]:
+                    self._by_alias.setdefault(normalize_language(a), l)
+
+        for alias, code in EXTRA_ALIASES.items():
+            if code in self._by_code:
+                self._by_alias.setdefault(alias, self._by_code[code])
+
+    @classmethod
+    def from_file(cls, path: str = LANGUAGES_FILE) -> "LanguageRegistry":
+        with open(path) as f:
+            return cls([Language(l["code"], l["name"]) for l in json.load(f)])
+
+    def get_by_code(self, code: str) -> Optional[Language]:
+        """
+        Returns the language of an ISO 639-1 code, region suffixes are ignored (e.g. "en-US").
+        """
+        code = re.split(r"[-_]", code.strip().lower())[0]
+        return self._by_code.get(code)
+
+    def get_by_name(self, name: str) -> Optional[Language]:
+        """
+        Returns the language with the given name or alias.
+        """
+        return self._by_alias.get(normalize_language(name))
+
+    def resolve(self, value: str) -> Optional[Language]:
+        """
+        Resolves a free form language answer, such as "english.", "English (US)" or "The text is
+        written in Turkish", to a known language. Only names are matched: words such as "no" or
+        "it" are also language codes, use `get_by_code` for the codes of langdetect.
+        """
+        if not value:
+            return None
+
+        language = self.get_by_name(value)
+        if language:
+            return language
+
+        normalized = normalize_language(value)
+        # Look for a language name within a sentence, longest names first
+        words = normalized.split()
+        for length in range(min(len(words), 3), 0, -1):
+            for i in range(len(words) - length + 1):
+                language = self._by_alias.get(" ".join(words[i : i + length]))
+                if language:
+                    return language
+
+        # Last resort, typos such as "englsh"
+        matches = difflib.get_close_matches(
+            normalized, self._by_alias, n=1, cutoff=0.85
+        )
+        return self._by_alias[matches[0]] if matches else None
+
+
+@lru_cache(maxsize=None)
+def get_language_registry() -> LanguageRegistry:
+    """
+    Returns the language registry, loading `languages.json` on first use.
+    """
+    return LanguageRegistry.from_file()
@@ -0,0 +1,176 @@
+import io
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+from importlib import metadata
+from typing import BinaryIO, Iterable, Iterator, Optional
+from langchain_core.documents import Document
+
+# Bump when the format of the cached entries, or the way documents are parsed, changes
+PARSE_CACHE_VERSION = 2
+
+# The package doing the actual parsing for each loader, its version is part of the cache key
+LOADER_PACKAGES = {
+    "PyPDFLoader": "pypdf",
+    "UnstructuredMarkdownLoader": "unstructured",
+    "UnstructuredWordDocumentLoader": "unstructured",
+    "TextLoader": "langchain-community",
+}
+
+
+def _package_version(package: str) -> str:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Returns the SHA-256 hex digest of the file's content.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_pages(f: BinaryIO, pages: Iterable[Document]) -> int:
+    """
+    Streams the pages to the binary file as gzipped JSON lines (one page per line), and returns
+    the number of written pages.
+    """
+    count = 0
+    with gzip.GzipFile(fileobj=f, mode="wb") as gz, io.TextIOWrapper(
+        gz, encoding="utf-8"
+    ) as text:
+        for page in pages:
+            text.write(
+                json.dumps(
+                    {"page_content": page.page_content, "metadata": page.metadata},
+                    ensure_ascii=False,
+                    default=str,
+                )
+            )
+            text.write("\n")
+            count += 1
+    # Closing the gzip stream writes its trailer, but leaves `f` open
+    f.flush()
+    return count
+
+
+def iter_pages(f: BinaryIO, source: Optional[str] = None) -> Iterator[Document]:
+    """
+    Lazily reads the pages written by `write_pages` from the start of the binary file, one page at a
+    time. If `source` is set, the pages' `source` metadata is replaced with it.
+    """
+    f.seek(0)
+    gz = gzip.GzipFile(fileobj=f, mode="rb")
+    for line in io.TextIOWrapper(gz, encoding="utf-8"):
+        page = json.loads(line)
+        if source is not None:
+            page["metadata"]["source"] = source
+        yield Document(page_content=page["page_content"], metadata=page["metadata"])
+
+
+def count_pages(f: BinaryIO) -> int:
+    f.seek(0)
+    return sum(1 for _ in io.TextIOWrapper(gzip.GzipFile(fileobj=f, mode="rb")))
+
+
+class ParseCache:
+    """
+    Content addressed cache of parsed documents, stored on the local disk in the `write_pages`
+    format. The least recently used entries are evicted once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file_path: str, loader_name: str) -> str:
+        """
+        Returns the cache key of a file parsed by the given loader: the hash of the file's content,
+        the loader and the version of the package that parses it.
+        """
+        loader_version = _package_version(
+            LOADER_PACKAGES.get(loader_name, "langchain-community")
+        )
+        fingerprint = "/".join(
+            [
+                hash_file(file_path),
+                loader_name,
+                loader_version,
+                _package_version("langchain-community"),
+                str(PARSE_CACHE_VERSION),
+            ]
+        )
+        return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jsonl.gz")
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """
+        Opens the cached entry of the key, or returns None if the key is not cached. The open file
+        stays readable even if the entry gets evicted afterwards.
+        """
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path)
+        return f
+
+    def put(self, key: str, pages: Iterable[Document]) -> BinaryIO:
+        """
+        Streams the pages into the entry of the key, evicts old entries if the cache is too large,
+        and returns the entry opened for reading.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write_pages(f, pages)
+            # Atomic, so readers never see a partially written entry
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        f = open(self._path(key), "rb")
+        self._evict()
+        return f
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache fits in `max_bytes`.
+        """
+        entries = []
+        total_size = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".jsonl.gz"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
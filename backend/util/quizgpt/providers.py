@@ -0,0 +1,152 @@
+import re
+import time
+import random
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Type, TypeVar
+import openai
+from langchain_openai import ChatOpenAI
+from langchain_core.pydantic_v1 import BaseModel
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class LLMProvider(ABC):
+    """
+    The language model QuizGPT generates questions and detects languages with.
+    """
+
+    @abstractmethod
+    def structured_completion(self, model: str, schema: Type[M], prompt: str) -> M:
+        """
+        Returns the model's answer to the prompt, as an instance of the schema.
+        """
+
+    @abstractmethod
+    def completion(self, model: str, prompt: str) -> str:
+        """
+        Returns the model's answer to the prompt.
+        """
+
+
+class OpenAIProvider(LLMProvider):
+    def __init__(self, api_key: str, max_retries: int = 2) -> None:
+        self.api_key = api_key
+        self.max_retries = max_retries
+
+    def structured_completion(self, model: str, schema: Type[M], prompt: str) -> M:
+        llm = ChatOpenAI(
+            model=model, api_key=self.api_key, max_retries=self.max_retries
+        )
+        return llm.with_structured_output(schema).invoke(prompt)
+
+    def completion(self, model: str, prompt: str) -> str:
+        client = openai.OpenAI(api_key=self.api_key, max_retries=self.max_retries)
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        return response.choices[0].message.content
+
+
+def get_openai_provider(api_key: str, rate_limited: bool) -> OpenAIProvider:
+    """
+    Returns the OpenAI provider of the API key. Its clients do not retry the rate limited calls,
+    the rate limiter does, and the clients retrying on their own would bypass it.
+    """
+    return OpenAIProvider(api_key, max_retries=0 if rate_limited else 2)
+
+
+# The segments of a batched prompt, and the language the questions must be in
+SEGMENT_PATTERN = re.compile(r"^\s*Segment (\d+):\s*$", re.MULTILINE)
+LANGUAGE_PATTERN = re.compile(r"The question's language must be (.+?)\.")
+
+
+class StubProvider(LLMProvider):
+    """
+    Offline provider for load tests, answering every prompt after `latency` seconds (plus up to
+    `latency_jitter`) with schema valid questions. A `failure_rate` share of the questions are
+    unsuccessful, and a `too_short_rate` share report that their content is too short.
+
+    Answers only depend on the prompt, the number of times it was sent before and `seed`, so runs
+    are reproducible and a retried prompt is not answered the same way.
+    """
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        latency_jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        too_short_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.too_short_rate = too_short_rate
+        self.seed = seed
+        # Prompt hash -> number of times it was sent
+        self._calls: Dict[str, int] = {}
+        self._calls_lock = threading.Lock()
+
+    def _random(self, prompt: str) -> random.Random:
+        key = hashlib.sha256(prompt.encode()).hexdigest()
+        with self._calls_lock:
+            call = self._calls.get(key, 0)
+            self._calls[key] = call + 1
+
+        digest = hashlib.sha256(f"{self.seed}:{call}:{key}".encode()).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    def _wait(self, rng: random.Random) -> None:
+        time.sleep(max(0.0, self.latency + rng.uniform(0, self.latency_jitter)))
+
+    def _question(self, rng: random.Random, number: int, language: str) -> dict:
+        roll = rng.random()
+        if roll < self.too_short_rate:
+            message = "The content is too short to generate a question."
+        elif roll < self.too_short_rate + self.failure_rate:
+            message = "The question could not be generated. Stub failure."
+        else:
+            correct = rng.randrange(4)
+            return {
+                "title": f"Stub question {number} ({rng.randrange(1_000_000)})?",
+                "answers": [
+                    {"title": f"Answer {i + 1}", "is_correct": i == correct}
+                    for i in range(4)
+                ],
+                "language": language,
+                "success": True,
+                "message": "",
+            }
+
+        return {
+            "title": "",
+            "answers": [],
+            "language": language,
+            "success": False,
+            "message": message,
+        }
+
+    def structured_completion(self, model: str, schema: Type[M], prompt: str) -> M:
+        rng = self._random(prompt)
+        self._wait(rng)
+
+        match = LANGUAGE_PATTERN.search(prompt)
+        language = match.group(1) if match else "English"
+
+        # A batched prompt (`Exam` schema), one question per numbered segment
+        segments: List[int] = [int(n) for n in SEGMENT_PATTERN.findall(prompt)]
+        if "questions" in schema.__fields__:
+            questions = [
+                {**self._question(rng, number, language), "segment": number}
+                for number in segments
+            ]
+            return schema.parse_obj({"questions": questions, "language": language})
+
+        return schema.parse_obj(self._question(rng, 1, language))
+
+    def completion(self, model: str, prompt: str) -> str:
+        self._wait(self._random(prompt))
+        return "english"
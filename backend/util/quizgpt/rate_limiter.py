@@ -0,0 +1,205 @@
+import time
+import random
+import hashlib
+from typing import Callable, List, Optional, TypeVar
+import openai
+import redis
+
+T = TypeVar("T")
+
+# Refills every bucket passed in KEYS at `capacity` per minute, and takes the requested amount
+# from all of them at once, or from none of them. Returns 0 if the amounts were taken, otherwise
+# the number of milliseconds to wait before the request can be made.
+# ARGV: capacity and requested amount of every bucket, in the order of KEYS
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local wait = 0
+local levels = {}
+local amounts = {}
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    -- A request larger than the bucket would never fit, it only waits for a full bucket
+    local amount = math.min(tonumber(ARGV[i * 2]), capacity)
+    local rate = capacity / 60000
+    local state = redis.call("HMGET", key, "level", "updated_at")
+    local level = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    level = math.min(capacity, level + math.max(0, now - updated_at) * rate)
+    levels[i] = level
+    amounts[i] = amount
+    if level < amount then
+        wait = math.max(wait, math.ceil((amount - level) / rate))
+    end
+end
+
+for i, key in ipairs(KEYS) do
+    local level = levels[i]
+    if wait == 0 then
+        level = level - amounts[i]
+    end
+    redis.call("HSET", key, "level", level, "updated_at", now)
+    redis.call("PEXPIRE", key, 120000)
+end
+
+return wait
+"""
+
+
+class RateLimitTimeout(Exception):
+    """
+    Raised when an OpenAI request is still rate limited, or failing, after every retry.
+    """
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Returns whether the OpenAI error is transient: rate limits, server errors, timeouts and
+    connection errors.
+    """
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        # APITimeoutError is an APIConnectionError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """
+    Returns the number of seconds the response of the error asks to wait, if any.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class OpenAIRateLimiter:
+    """
+    Paces the OpenAI requests of every worker sharing the Redis server, with token buckets of
+    requests and tokens per minute, keyed by API key and model.
+
+    Transient errors are retried with a jittered exponential backoff. After `failure_threshold`
+    consecutive failures the circuit opens: every worker holds its requests for `cooldown` seconds,
+    instead of failing them all against an API that is already rejecting requests.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_retries: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        prefix: str = "quizgpt:ratelimit",
+    ) -> None:
+        self.client = client
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.prefix = prefix
+        self.token_bucket = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def _key(self, api_key: str, model: str) -> str:
+        # Never store the API key itself
+        api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:32]
+        return f"{self.prefix}:{api_key_hash}:{model}"
+
+    def acquire(self, api_key: str, model: str, tokens: int) -> None:
+        """
+        Blocks until a request of `tokens` tokens can be made with the API key and model.
+        """
+        key = self._key(api_key, model)
+        keys: List[str] = []
+        args: List[int] = []
+        if self.requests_per_minute > 0:
+            keys.append(f"{key}:requests")
+            args += [self.requests_per_minute, 1]
+        if self.tokens_per_minute > 0:
+            keys.append(f"{key}:tokens")
+            args += [self.tokens_per_minute, max(1, tokens)]
+        if not keys:
+            return
+
+        while True:
+            wait = int(self.token_bucket(keys=keys, args=args))
+            if wait <= 0:
+                return
+            # Jitter, so that the waiting workers do not all retry at the same millisecond
+            time.sleep(wait / 1000 * random.uniform(1.0, 1.2))
+
+    def _wait_for_circuit(self, key: str) -> None:
+        """
+        Blocks while the circuit of the key is open.
+        """
+        remaining = self.client.pttl(f"{key}:circuit")
+        if remaining > 0:
+            time.sleep(remaining / 1000 * random.uniform(1.0, 1.2))
+
+    def _record_failure(self, key: str) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.incr(f"{key}:failures")
+        pipeline.expire(f"{key}:failures", max(1, int(self.cooldown * 2)))
+        failures = pipeline.execute()[0]
+        # Until a request succeeds, every failure after the cooldown opens the circuit again
+        if failures >= self.failure_threshold:
+            self.client.set(f"{key}:circuit", 1, px=max(1, int(self.cooldown * 1000)))
+
+    def _record_success(self, key: str) -> None:
+        self.client.delete(f"{key}:failures")
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """
+        Returns the seconds to wait before the next attempt, "full jitter" exponential backoff
+        unless the response asks for a longer wait.
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(self.backoff_max, retry_after))
+        return delay
+
+    def call(
+        self, api_key: str, model: str, tokens: int, request: Callable[[], T]
+    ) -> T:
+        """
+        Makes the request once the rate limits allow it, retrying transient errors.
+
+        `tokens` is the estimated number of tokens of the request, prompt and completion.
+        """
+        key = self._key(api_key, model)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_circuit(key)
+            self.acquire(api_key, model, tokens)
+            try:
+                result = request()
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                self._record_failure(key)
+                if attempt >= self.max_retries:
+                    raise RateLimitTimeout(
+                        f"OpenAI request failed after {attempt + 1} attempts: {e}"
+                    ) from e
+                delay = self._backoff(attempt, e)
+                print(f"OpenAI request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self._record_success(key)
+            return result
+
+        # Not reached, the last attempt either returns or raises
+        raise RateLimitTimeout("OpenAI request failed")
@@ -0,0 +1,91 @@
+import time
+import hashlib
+from typing import Optional
+import redis
+
+
+class ResponseCache:
+    """
+    Redis backed cache of GPT responses. Entries expire after `ttl` seconds, and the least recently
+    used ones are evicted once there are more than `max_entries`.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        ttl: int,
+        max_entries: int,
+        prefix: str = "quizgpt:responses",
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        # Sorted set of the cached keys, scored by their last use
+        self.index_key = f"{prefix}:index"
+        self.hits_key = f"{prefix}:hits"
+        self.misses_key = f"{prefix}:misses"
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """
+        Returns a cache key for the given parts, e.g. the content, language, model and prompt version.
+        """
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def _entry_key(self, key: str) -> str:
+        return f"{self.prefix}:entry:{key}"
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached value of the key, or None on a miss.
+        """
+        value = self.client.get(self._entry_key(key))
+
+        pipeline = self.client.pipeline(transaction=False)
+        if value is None:
+            pipeline.incr(self.misses_key)
+        else:
+            pipeline.incr(self.hits_key)
+            # Refreshed with the index score, so that the index does not drop a live entry
+            pipeline.expire(self._entry_key(key), self.ttl)
+            pipeline.zadd(self.index_key, {key: time.time()})
+        pipeline.execute()
+
+        return value.decode() if value is not None else None
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Caches the value under the key, then evicts entries that are expired or over `max_entries`.
+        """
+        now = time.time()
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.set(self._entry_key(key), value, ex=self.ttl)
+        pipeline.zadd(self.index_key, {key: now})
+        # The entries expire on their own, only their index needs cleaning up
+        pipeline.zremrangebyscore(self.index_key, 0, now - self.ttl)
+        pipeline.zcard(self.index_key)
+        overflow = pipeline.execute()[-1] - self.max_entries
+
+        if overflow > 0:
+            evicted = self.client.zpopmin(self.index_key, overflow)
+            if evicted:
+                self.client.delete(*[self._entry_key(k.decode()) for k, _ in evicted])
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters and the number of cached entries.
+        """
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.get(self.hits_key)
+        pipeline.get(self.misses_key)
+        pipeline.zcard(self.index_key)
+        hits, misses, entries = pipeline.execute()
+        hits, misses = int(hits or 0), int(misses or 0)
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0,
+            "entries": entries,
+        }
@@ -0,0 +1,168 @@
+import re
+from typing import Callable, Iterable, Iterator, List, Tuple
+import tiktoken
+
+# Blank lines separate paragraphs
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+# Whitespace following the end of a sentence, including CJK and Arabic punctuation
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?;。！？؟])\s+")
+
+
+class Segmenter:
+    """
+    Splits document text into segments on paragraph and sentence boundaries, balanced by the
+    number of tokens of the target model and capped to `max_segment_tokens`.
+    """
+
+    def __init__(self, model: str, max_segment_tokens: int) -> None:
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Model unknown to this version of tiktoken
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.max_segment_tokens = max_segment_tokens
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def split_units(self, text: str) -> List[str]:
+        """
+        Splits the text into its paragraphs' sentences, with their whitespace normalized.
+        """
+        units = []
+        for paragraph in PARAGRAPH_PATTERN.split(text):
+            for sentence in SENTENCE_PATTERN.split(paragraph):
+                sentence = " ".join(sentence.split())
+                if sentence:
+                    units.append(sentence)
+        return units
+
+    def _split_words(self, unit: str, max_tokens: int) -> List[str]:
+        """
+        Splits a unit into parts of up to `max_tokens` tokens, on word boundaries.
+        """
+        parts = []
+        words: List[str] = []
+        tokens = 0
+        for word in unit.split(" "):
+            word_tokens = self.count_tokens(" " + word)
+            if words and tokens + word_tokens > max_tokens:
+                parts.append(" ".join(words))
+                words, tokens = [], 0
+            words.append(word)
+            tokens += word_tokens
+        if words:
+            parts.append(" ".join(words))
+        return parts
+
+    def _iter_units(self, texts: Iterable[str]) -> Iterator[Tuple[str, int]]:
+        """
+        Yields the units of the texts with their number of tokens. Units longer than
+        `max_segment_tokens` are split on word boundaries.
+        """
+        for text in texts:
+            for unit in self.split_units(text):
+                tokens = self.count_tokens(unit)
+                if tokens <= self.max_segment_tokens:
+                    yield unit, tokens
+                    continue
+                for part in self._split_words(unit, self.max_segment_tokens):
+                    yield part, self.count_tokens(part)
+
+    def segment(
+        self, texts: Callable[[], Iterable[str]], num_segments: int
+    ) -> List[str]:
+        """
+        Splits the texts (e.g. the pages of a document) into `num_segments` contiguous segments
+        with roughly the same number of tokens. Segments never cut through a sentence, unless the
+        sentence alone is longer than `max_segment_tokens`, and are trimmed to `max_segment_tokens`.
+
+        `texts` is called to iterate over the texts, twice: once to count the tokens of every unit
+        and find the segments' boundaries, then to collect the text of the kept units only. The
+        whole text is never held in memory.
+
+        Segments are empty if the texts do not have enough words for `num_segments` segments.
+        """
+        counts = [tokens for _, tokens in self._iter_units(texts())]
+
+        # Not enough sentences for every segment, the content is small enough to be split in memory
+        if len(counts) < num_segments:
+            return self._segment_short(list(self._iter_units(texts())), num_segments)
+
+        boundaries = self._balanced_boundaries(counts, num_segments)
+
+        # The units kept by each segment, from its start up to `max_segment_tokens`
+        kept_until = []
+        for start, end in zip(boundaries, boundaries[1:]):
+            stop = start
+            tokens = 0
+            while stop < end and (
+                stop == start or tokens + counts[stop] <= self.max_segment_tokens
+            ):
+                tokens += counts[stop]
+                stop += 1
+            kept_until.append(stop)
+
+        segments_units: List[List[str]] = [[] for _ in range(num_segments)]
+        current = 0
+        for i, (unit, _) in enumerate(self._iter_units(texts())):
+            while i >= boundaries[current + 1]:
+                current += 1
+            if i < kept_until[current]:
+                segments_units[current].append(unit)
+
+        return [" ".join(units) for units in segments_units]
+
+    def _segment_short(
+        self, units: List[Tuple[str, int]], num_segments: int
+    ) -> List[str]:
+        """
+        Splits content with fewer units than segments, by splitting its longest units in half.
+        """
+        # Split the longest units in half until there is a unit for every segment
+        while len(units) < num_segments and units:
+            i = max(range(len(units)), key=lambda i: units[i][1])
+            unit, tokens = units[i]
+            halves = self._split_words(unit, max(1, tokens // 2))
+            if len(halves) < 2:
+                break
+            first, second = halves[0], " ".join(halves[1:])
+            units[i : i + 1] = [
+                (first, self.count_tokens(first)),
+                (second, self.count_tokens(second)),
+            ]
+
+        segments = [unit for unit, _ in units]
+        return segments + [""] * (num_segments - len(segments))
+
+    @staticmethod
+    def _balanced_boundaries(counts: List[int], num_segments: int) -> List[int]:
+        """
+        Returns the `num_segments + 1` unit indexes delimiting segments of similar token counts.
+        """
+        total = sum(counts)
+        prefix = [0]
+        for count in counts:
+            prefix.append(prefix[-1] + count)
+
+        boundaries = [0]
+        i = 0
+        for k in range(1, num_segments):
+            target = total * k / num_segments
+            while i < len(counts) and prefix[i + 1] <= target:
+                i += 1
+            # Pick the closest boundary to the target
+            if i < len(counts) and target - prefix[i] > prefix[i + 1] - target:
+                i += 1
+            # Leave at least one unit to each segment, when there are enough units
+            remaining = num_segments - k
+            boundary = max(boundaries[-1] + 1, min(i, len(counts) - remaining))
+            boundaries.append(min(boundary, len(counts)))
+        boundaries.append(len(counts))
+        return boundaries
+
+    def estimate_tokens(self, segments: List[str]) -> int:
+        """
+        Returns the number of tokens of the segments.
+        """
+        return sum(self.count_tokens(segment) for segment in segments)
@@ -0,0 +1,11 @@
+import redis
+from functools import lru_cache
+from app import app
+
+
+@lru_cache(maxsize=None)
+def get_redis() -> redis.Redis:
+    """
+    Returns the Redis client shared by the process, connected to `REDIS_URL`.
+    """
+    return redis.Redis.from_url(app.config["REDIS_URL"])
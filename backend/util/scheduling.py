@@ -0,0 +1,140 @@
+import os
+import time
+from typing import Dict, List, Optional
+import redis
+from app import app
+
+# Queues ("lanes") of the quiz generation tasks, so that small quizzes do not wait behind large ones
+SMALL_LANE = "quizzes.small"
+LARGE_LANE = "quizzes.large"
+LANES = [SMALL_LANE, LARGE_LANE]
+
+# Priorities of the Redis broker, 0 is consumed first
+PRIORITY_STEPS = list(range(10))
+
+ACTIVE_KEY = "quizgpt:active:{client}"
+WAIT_STATS_KEY = "quizgpt:queue-wait:{lane}"
+
+
+def choose_lane(number_of_questions: int, upload_size: int) -> str:
+    if (
+        number_of_questions > app.config["LARGE_QUIZ_MIN_QUESTIONS"]
+        or upload_size > app.config["LARGE_QUIZ_MIN_UPLOAD_BYTES"]
+    ):
+        return LARGE_LANE
+    return SMALL_LANE
+
+
+def _upload_size(paths: List[str]) -> int:
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def _task_argument(args, kwargs, name: str, position: int, default=None):
+    """
+    Returns the argument of a task sent with either positional or keyword arguments.
+    """
+    if kwargs and name in kwargs:
+        return kwargs[name]
+    if args and len(args) > position:
+        return args[position]
+    return default
+
+
+def route_task(name, args, kwargs, options, task=None, **kw) -> Optional[dict]:
+    """
+    Celery router (see `task_routes` in `Config.CELERY`), sends the quiz generation tasks to the
+    lane of their quiz's size. Queues set explicitly when sending a task take precedence.
+    """
+    if name == "tasks.create_quiz":
+        number_of_questions = _task_argument(args, kwargs, "number_of_questions", 6, 0)
+        paths = _task_argument(args, kwargs, "created_files_paths", 7, [])
+        return {
+            "queue": choose_lane(
+                int(number_of_questions or 0), _upload_size(paths or [])
+            )
+        }
+    if name == "tasks.generate_quiz_question":
+        # The files are parsed by create_quiz already
+        number_of_questions = _task_argument(args, kwargs, "number_of_questions", 4, 0)
+        return {"queue": choose_lane(int(number_of_questions or 0), 0)}
+    if name == "tasks.persist_quiz":
+        return {"queue": SMALL_LANE}
+    return None
+
+
+class FairScheduler:
+    """
+    Counts the quizzes each client has queued or running, and gives their next quiz a lower
+    priority the more they have, so that a client enqueuing many quizzes does not starve others.
+    Counters expire after `ttl` seconds, in case a task never reports that it is done.
+    """
+
+    def __init__(self, client: redis.Redis, ttl: int) -> None:
+        self.client = client
+        self.ttl = ttl
+
+    def enter(self, client_id: str) -> int:
+        """
+        Records a new quiz of the client, and returns the priority of its task.
+        """
+        key = ACTIVE_KEY.format(client=client_id)
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.incr(key)
+        pipeline.expire(key, self.ttl)
+        active = pipeline.execute()[0]
+        return min(active - 1, PRIORITY_STEPS[-1])
+
+    def leave(self, client_id: str) -> None:
+        """
+        Records that a quiz of the client is done.
+        """
+        key = ACTIVE_KEY.format(client=client_id)
+        if self.client.decr(key) <= 0:
+            self.client.delete(key)
+
+    def record_wait(self, lane: str, wait: float) -> None:
+        """
+        Records the time a task waited in the lane before a worker started it, in seconds.
+        """
+        key = WAIT_STATS_KEY.format(lane=lane)
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.hincrby(key, "count", 1)
+        pipeline.hincrbyfloat(key, "total_wait", wait)
+        pipeline.hset(key, "last_wait", wait)
+        pipeline.hset(key, "last_started_at", time.time())
+        pipeline.execute()
+
+    def lane_stats(self, sep: str) -> Dict[str, dict]:
+        """
+        Returns the number of queued tasks and the wait times of each lane.
+
+        The Redis broker stores each priority of a queue in its own list, `sep` separates the
+        queue's name and the priority.
+        """
+        pipeline = self.client.pipeline(transaction=False)
+        for lane in LANES:
+            for priority in PRIORITY_STEPS:
+                pipeline.llen(lane if priority == 0 else f"{lane}{sep}{priority}")
+            pipeline.hgetall(WAIT_STATS_KEY.format(lane=lane))
+        results = pipeline.execute()
+
+        stats = {}
+        step = len(PRIORITY_STEPS) + 1
+        for i, lane in enumerate(LANES):
+            depths = results[i * step : i * step + len(PRIORITY_STEPS)]
+            wait = {
+                k.decode(): float(v) for k, v in results[i * step + step - 1].items()
+            }
+            count = int(wait.get("count", 0))
+            stats[lane] = {
+                "depth": sum(depths),
+                "depth_by_priority": {
+                    str(priority): depth
+                    for priority, depth in zip(PRIORITY_STEPS, depths)
+                    if depth
+                },
+                "started": count,
+                "average_wait": wait["total_wait"] / count if count else None,
+                "last_wait": wait.get("last_wait"),
+            }
+        return stats
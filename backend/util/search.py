@@ -0,0 +1,84 @@
+from typing import Optional
+from sqlalchemy import func, literal, cast
+from sqlalchemy.dialects.postgresql import REGCONFIG, TSQUERY
+
+# Postgres text search configurations of the quiz languages, by code. Quizzes in the other
+# languages are indexed with "simple", which lowercases the words without stemming them.
+TEXT_SEARCH_CONFIGS = {
+    "ar": "arabic",
+    "da": "danish",
+    "de": "german",
+    "el": "greek",
+    "en": "english",
+    "es": "spanish",
+    "fi": "finnish",
+    "fr": "french",
+    "ga": "irish",
+    "hu": "hungarian",
+    "id": "indonesian",
+    "it": "italian",
+    "lt": "lithuanian",
+    "ne": "nepali",
+    "nl": "dutch",
+    "no": "norwegian",
+    "pt": "portuguese",
+    "ro": "romanian",
+    "ru": "russian",
+    "sv": "swedish",
+    "ta": "tamil",
+    "tr": "turkish",
+}
+DEFAULT_TEXT_SEARCH_CONFIG = "simple"
+
+
+def text_search_config_sql(language_column: str) -> str:
+    """
+    Returns the SQL expression of the text search configuration of a row's language.
+    """
+    cases = " ".join(
+        f"WHEN '{code}' THEN '{config}'::regconfig"
+        for code, config in TEXT_SEARCH_CONFIGS.items()
+    )
+    return f"CASE {language_column} {cases} ELSE '{DEFAULT_TEXT_SEARCH_CONFIG}'::regconfig END"
+
+
+def quiz_search_vector_sql() -> str:
+    """
+    Returns the SQL expression of `quiz.search_vector`, the title weighing more than the
+    description.
+    """
+    config = text_search_config_sql("language")
+    return (
+        f"setweight(to_tsvector({config}, coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector({config}, coalesce(description, '')), 'B')"
+    )
+
+
+def quiz_search_query(search_query: str, language: Optional[str] = None):
+    """
+    Returns the tsquery of the search, stemmed like the quizzes of `language`. Without a language,
+    the search is stemmed with every configuration, so that it matches the quizzes of any of them.
+    """
+    if language:
+        configs = [TEXT_SEARCH_CONFIGS.get(language, DEFAULT_TEXT_SEARCH_CONFIG)]
+    else:
+        configs = [
+            DEFAULT_TEXT_SEARCH_CONFIG,
+            *sorted(set(TEXT_SEARCH_CONFIGS.values())),
+        ]
+
+    # The same for every row, so that the GIN index can be used
+    tsquery = None
+    for config in configs:
+        query = func.websearch_to_tsquery(
+            cast(literal(config), REGCONFIG), search_query, type_=TSQUERY
+        )
+        tsquery = query if tsquery is None else tsquery.op("||")(query)
+    return tsquery
+
+
+def escape_like(value: str) -> str:
+    """
+    Escapes the wildcards of a LIKE pattern, with "\\" as the escape character.
+    """
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
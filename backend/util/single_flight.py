@@ -0,0 +1,60 @@
+import hashlib
+from typing import Optional
+import redis
+
+# Deletes the lock only if it is still held by the owner, so that an expired lock taken over by
+# another request is never released by the previous owner
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Redis locks that let identical requests share a single in-flight task: the first request takes
+    the lock with its task's ID, the following ones get that ID until the task releases the lock.
+    Locks expire after `ttl` seconds, in case their task never releases them.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        ttl: int,
+        prefix: str = "quizgpt:single-flight",
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.release_script = client.register_script(RELEASE_SCRIPT)
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """
+        Returns the key of the requests with the given parts, e.g. the files' hashes and options.
+        """
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def acquire(self, key: str, owner: str) -> Optional[str]:
+        """
+        Takes the lock of the key for `owner` (e.g. a task ID). Returns None if it was taken, or the
+        owner currently holding it.
+        """
+        lock_key = self._lock_key(key)
+        # The lock can expire between the two commands, then it is free to take again
+        for _ in range(3):
+            if self.client.set(lock_key, owner, nx=True, ex=self.ttl):
+                return None
+            current = self.client.get(lock_key)
+            if current is not None:
+                return current.decode()
+        # Never expected, do not share a task rather than failing the request
+        return None
+
+    def release(self, key: str, owner: str) -> None:
+        self.release_script(keys=[self._lock_key(key)], args=[owner])
@@ -0,0 +1,127 @@
+import os
+import re
+import hashlib
+import tempfile
+from abc import ABC, abstractmethod
+from uuid import uuid4
+from typing import BinaryIO, NamedTuple
+from app import app
+
+# Name of the uploads' references, prefixed by their content's hash
+REFERENCE_PATTERN = re.compile(
+    r"^(?P<sha256>[0-9a-f]{64})-[0-9a-f-]+\.(?P<extension>\w+)$"
+)
+
+
+class StoredUpload(NamedTuple):
+    # What the worker gets to read the upload, and releases once done with it
+    reference: str
+    sha256: str
+    size: int
+
+
+class UploadStorage(ABC):
+    """
+    Where the uploaded files are kept until their quiz is generated. Uploads with the same content
+    share the same data, which is only deleted once every reference to it is released.
+    """
+
+    @abstractmethod
+    def save(self, stream: BinaryIO, extension: str) -> StoredUpload:
+        """
+        Stores the stream's content, read in chunks, and returns a new reference to it.
+        """
+
+    @abstractmethod
+    def local_path(self, reference: str) -> str:
+        """
+        Returns the path of the upload on the local filesystem, for the parsers to read.
+        """
+
+    @abstractmethod
+    def release(self, reference: str) -> None:
+        """
+        Deletes the reference, and the upload's data once it is not referenced anymore. Releasing a
+        reference twice has no effect.
+        """
+
+
+class LocalUploadStorage(UploadStorage):
+    """
+    Stores the uploads in `directory`, a blob per content (`blobs/<sha256>.<extension>`) and a hard
+    link to it per reference. The blob's link count is its reference count, so there is no
+    separate count to keep in sync, even across processes.
+    """
+
+    def __init__(self, directory: str, chunk_size: int = 1024 * 1024) -> None:
+        self.directory = directory
+        self.blobs_directory = os.path.join(directory, "blobs")
+        self.chunk_size = chunk_size
+        os.makedirs(self.blobs_directory, exist_ok=True)
+
+    def _blob_path(self, sha256: str, extension: str) -> str:
+        return os.path.join(self.blobs_directory, f"{sha256}.{extension}")
+
+    def save(self, stream: BinaryIO, extension: str) -> StoredUpload:
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.blobs_directory, suffix=".tmp")
+        try:
+            # Hash while writing, so that the content is only read once
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            digest = sha256.hexdigest()
+            blob_path = self._blob_path(digest, extension)
+            reference = os.path.join(self.directory, f"{digest}-{uuid4()}.{extension}")
+            try:
+                # Fails if the same content is already stored
+                os.link(temp_path, blob_path)
+            except FileExistsError:
+                pass
+
+            try:
+                os.link(blob_path, reference)
+            except FileNotFoundError:
+                # The blob was released in the meantime, the new reference keeps this copy
+                os.link(temp_path, reference)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return StoredUpload(reference=reference, sha256=digest, size=size)
+
+    def local_path(self, reference: str) -> str:
+        return reference
+
+    def release(self, reference: str) -> None:
+        if os.path.exists(reference):
+            os.remove(reference)
+
+        match = REFERENCE_PATTERN.match(os.path.basename(reference))
+        if not match:
+            # Not stored by this storage, e.g. uploaded before it existed
+            return
+
+        blob_path = self._blob_path(match["sha256"], match["extension"])
+        try:
+            # Only the blob's own link is left
+            if os.stat(blob_path).st_nlink <= 1:
+                os.remove(blob_path)
+        except FileNotFoundError:
+            pass
+
+
+def get_upload_storage() -> UploadStorage:
+    """
+    Returns the upload storage configured by `UPLOAD_STORAGE`.
+    """
+    if app.config["UPLOAD_STORAGE"] == "local":
+        return LocalUploadStorage(
+            app.config["UPLOAD_DIR"], chunk_size=app.config["UPLOAD_CHUNK_SIZE"]
+        )
+
+    raise ValueError(f"Unsupported upload storage: {app.config['UPLOAD_STORAGE']}")
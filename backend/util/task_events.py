@@ -0,0 +1,76 @@
+import json
+from typing import Optional
+import redis
+from celery import states
+
+# Channel the events of a task are published to, see `publish_task_event`
+TASK_EVENTS_CHANNEL = "quizgpt:task-events:{task_id}"
+
+API_KEY_ERROR = "Incorrect API key provided"
+
+
+def task_events_channel(task_id: str) -> str:
+    return TASK_EVENTS_CHANNEL.format(task_id=task_id)
+
+
+def publish_task_event(
+    client: redis.Redis, task_id: str, state: str, meta: Optional[dict] = None
+) -> None:
+    """
+    Publishes a state change of the task to the subscribers of its channel, e.g. its progress or
+    its completion. Events are not stored, subscribers read the task's current state first.
+    """
+    client.publish(
+        task_events_channel(task_id),
+        json.dumps({"state": state, "meta": meta}, default=str),
+    )
+
+
+def serialize_task_meta(meta: dict) -> dict:
+    """
+    Returns the response of the task result endpoints for the task meta stored by the result
+    backend (as returned by `backend.get_task_meta`).
+    """
+    state = meta.get("status", states.PENDING)
+    result = meta.get("result")
+    ready = state in states.READY_STATES
+
+    response = {
+        "ready": ready,
+        "successful": state == states.SUCCESS,
+        "state": state,
+        "value": result if ready else None,
+    }
+
+    if ready:
+        value = result
+        # Failed tasks store their exception instead of a result
+        if not isinstance(value, dict) or "details" not in value:
+            response["successful"] = False
+            value = {
+                "message": "Error during quiz creation",
+                "quiz_id": None,
+                "details": {
+                    "response_message": str(value),
+                    "response_code": 500,
+                },
+            }
+
+        # Incorrect OpenAI API key provided
+        if API_KEY_ERROR in str(value["details"]["response_message"]):
+            response["successful"] = False
+            value = {
+                "message": "Error during quiz creation",
+                "quiz_id": None,
+                "details": {
+                    "response_message": API_KEY_ERROR,
+                    "response_code": 401,
+                },
+            }
+
+        response["value"] = value
+
+    if state == "PROGRESS":
+        response["progress"] = result
+
+    return response
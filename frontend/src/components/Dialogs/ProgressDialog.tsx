@@ -10,7 +10,7 @@ import {
   linearProgressClasses,
 } from "@mui/material";
 import { useTranslation } from "next-i18next";
-import { customFetch } from "@/util";
+import { customFetch, PUBLIC_API_URL } from "@/util";
 import { styled } from "@mui/system";
 
 interface CreateQuizTaskResult {
@@ -31,6 +31,8 @@ interface ProgressResponse {
     total: number;
   };
   value?: CreateQuizTaskResult;
+  // Whether the server streams the task's progress
+  stream?: boolean;
 }
 
 interface ProgressDialogProps {
@@ -73,32 +75,40 @@ const ProgressDialog: React.FC<ProgressDialogProps> = ({
   const [currentQuestions, setCurrentQuestions] = useState(0);
 
   useEffect(() => {
-    const fetchProgress = async () => {
-      try {
-        let timeoutId: NodeJS.Timeout | null = null;
+    let timeoutId: NodeJS.Timeout | null = null;
+    let eventSource: EventSource | null = null;
+    let canStream = typeof EventSource !== "undefined";
+
+    // Returns whether the task is done
+    const handleProgress = (data: ProgressResponse) => {
+      if (data.progress) {
+        setCurrentQuestions(data.progress.current);
+      }
 
-        const response = await customFetch(`/tasks/result/${taskId}`);
-        const data: ProgressResponse = await response.json();
+      if (data.successful && data.value) {
+        onSuccess(data.value);
+        setCurrentQuestions(0);
+      } else if (data.ready && !data.successful && data.value) {
+        onError(data.value.details.response_message);
+        setCurrentQuestions(0);
+      }
 
-        if (data.progress) {
-          setCurrentQuestions(data.progress.current);
-        }
+      if (data.ready) {
+        onClose();
+        setCurrentQuestions(0);
+      }
 
-        if (data.successful && data.value) {
-          onSuccess(data.value);
-          setCurrentQuestions(0);
-        } else if (data.ready && !data.successful && data.value) {
-          onError(data.value.details.response_message);
-          setCurrentQuestions(0);
+      return data.ready;
+    };
 
-          if (timeoutId) clearTimeout(timeoutId);
-        }
+    const fetchProgress = async () => {
+      try {
+        const response = await customFetch(`/tasks/result/${taskId}`);
+        const data: ProgressResponse = await response.json();
 
-        if (!data.ready) {
-          timeoutId = setTimeout(fetchProgress, 1000);
-        } else {
-          onClose();
-          setCurrentQuestions(0);
+        if (!handleProgress(data)) {
+          if (canStream && data.stream) streamProgress();
+          else timeoutId = setTimeout(fetchProgress, 1000);
         }
       } catch (error: any) {
         console.error(error);
@@ -107,7 +117,33 @@ const ProgressDialog: React.FC<ProgressDialogProps> = ({
       }
     };
 
+    const streamProgress = () => {
+      eventSource = new EventSource(`${PUBLIC_API_URL}/tasks/stream/${taskId}`);
+
+      const onEvent = (event: MessageEvent) => {
+        if (handleProgress(JSON.parse(event.data))) {
+          eventSource?.close();
+        }
+      };
+      eventSource.addEventListener("progress", onEvent);
+      eventSource.addEventListener("result", onEvent);
+
+      // The browser reconnects on its own, unless the stream could not be opened at all
+      eventSource.onerror = () => {
+        if (eventSource?.readyState === EventSource.CLOSED) {
+          canStream = false;
+          fetchProgress();
+        }
+      };
+    };
+
+    // Polls once first, the response tells whether the server streams the progress
     if (taskId) fetchProgress();
+
+    return () => {
+      if (timeoutId) clearTimeout(timeoutId);
+      eventSource?.close();
+    };
   }, [taskId, onClose]);
 
   return (